@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+Simulate chatbot conversations through the webhook entry point
+(``WhatsAppWebhook._process_whatsapp_notification``) on an Odoo test database
+with ``meta_whatsapp_chat_bot`` installed, and report the per-message decision
+latency, SQL queries and throughput.
+
+Replies are never sent: the chatbot queues them as outbound messages, which
+the simulator collects into a local sink instead of dispatching them to the
+Graph API. Everything runs in one transaction that is rolled back at the end.
+
+A script is a JSON file with the rules to create and the conversations to
+play, each step optionally stating a substring its reply must contain::
+
+    {
+        "rules": [
+            {"name": "Order", "pattern": "order", "reply": "Your order number?", "next_step": "order"},
+            {"name": "Order number", "match_type": "regex", "pattern": "\\\\d+", "step": "order",
+             "save_as": "order_ref", "next_step": "confirm", "reply": "Thanks, reply yes to confirm."},
+            {"name": "Confirm", "pattern": "yes", "step": "confirm", "reply": "Done, we are looking into it."}
+        ],
+        "conversations": [
+            [{"text": "hello, about my order", "expect": "order number"}, {"text": "4711", "expect": "confirm"},
+             {"text": "yes", "expect": "looking into it"}]
+        ]
+    }
+
+Without a script, a flow like the one above is generated, padded with
+``--rules`` filler keyword and regex rules. Every conversation is played by
+``--users`` distinct WhatsApp ids.
+
+Example::
+
+    python -m benchmarks.chatbot_simulator -d bench_db --addons-path=odoo/addons,. \\
+        --rules 2000 --users 200 --json chatbot.json
+"""
+import argparse
+import json
+import time
+
+from .common import WORDS, add_odoo_arguments, emit_report, odoo_environment, summarize
+from .payloads import WebhookPayloadGenerator
+from .webhook_replay import prepare_config
+
+DEFAULT_FLOW = {
+    'rules': [
+        {'name': 'Greeting', 'pattern': 'hello\nhi', 'reply': 'Hello! Type "order" to follow an order.',
+         'sequence': 20},
+        {'name': 'Order', 'pattern': 'order', 'reply': 'Please send your order number.', 'next_step': 'order',
+         'sequence': 10},
+        {'name': 'Order number', 'match_type': 'regex', 'pattern': r'\d{3,}', 'step': 'order',
+         'save_as': 'order_ref', 'next_step': 'confirm', 'reply': 'Thanks, reply "yes" to confirm this order.',
+         'sequence': 5},
+        {'name': 'Confirm', 'pattern': 'yes', 'step': 'confirm', 'reply': 'Done, your order is on its way.',
+         'sequence': 5},
+        {'name': 'Talk to us', 'match_type': 'button', 'pattern': 'HUMAN', 'reply': 'An operator will answer you.',
+         'sequence': 1},
+    ],
+    'conversations': [
+        [{'text': 'hello there', 'expect': 'Hello'},
+         {'text': 'where is my order please', 'expect': 'order number'},
+         {'text': 'it is 48213', 'expect': 'confirm'},
+         {'text': 'yes', 'expect': 'on its way'}],
+        [{'text': 'refund status today'},
+         {'payload': 'HUMAN', 'text': 'Talk to us', 'expect': 'operator'}],
+    ],
+}
+
+
+def filler_rules(count):
+    """Rules that never match the scripted conversations, to grow the matcher."""
+    rules = []
+    for index in range(count):
+        if index % 10:
+            rules.append({'name': f'Filler {index}', 'pattern': f'{WORDS[index % len(WORDS)]}{index}',
+                          'reply': f'Filler reply {index}', 'sequence': 100})
+        else:
+            rules.append({'name': f'Filler regex {index}', 'match_type': 'regex',
+                          'pattern': rf'sku-{index}-\d+', 'reply': f'Filler reply {index}', 'sequence': 100})
+    return rules
+
+
+class OutboundSink:
+    """Collect the outbound messages queued since the last call, instead of sending them."""
+
+    def __init__(self, env):
+        self.Outbound = env['whatsapp.outbound.message'].sudo()
+        last = self.Outbound.search([], order='id desc', limit=1)
+        self.last_id = last.id
+        self.messages = []
+
+    def collect(self):
+        queued = self.Outbound.search([('id', '>', self.last_id)], order='id')
+        if queued:
+            self.last_id = queued[-1].id
+        captured = [{'number': message.number, 'body': message.body} for message in queued]
+        self.messages += captured
+        return captured
+
+
+def prepare_rules(env, config, rules):
+    env['whatsapp.chatbot.rule'].sudo().create([
+        dict({'match_type': 'keyword', 'config_ids': [(4, config.id)]}, **rule) for rule in rules
+    ])
+
+
+def simulate(env, config, conversations, users, seed=0):
+    """
+    Play every conversation for ``users`` WhatsApp ids, one webhook payload
+    per step. Returns the summaries and the failed expectations.
+    """
+    from odoo.addons.meta_whatsapp_all_in_one.controller.main_controller import WhatsAppWebhook
+    from odoo.addons.meta_whatsapp_all_in_one.tools import instrumentation
+
+    webhook = WhatsAppWebhook()
+    generator = WebhookPayloadGenerator(config.instance_id, seed=seed)
+    sink = OutboundSink(env)
+    cr = env.cr
+    latencies, decisions, queries, failures = [], [], [], []
+    started = time.perf_counter()
+    for user in range(users):
+        for conversation_index, conversation in enumerate(conversations):
+            number = '4915%09d' % (user * len(conversations) + conversation_index)
+            for step_index, step in enumerate(conversation):
+                if step.get('payload'):
+                    message, contact = generator.button_message(number, step['payload'], step.get('text'))
+                else:
+                    message, contact = generator.text_message(number=number, body=step['text'])
+                payload = generator.inbound_payload([message], [contact])
+                decided = instrumentation.totals().get('chatbot.decide', {}).get('count', 0)
+                query_start = cr.sql_log_count
+                op_start = time.perf_counter()
+                webhook._process_whatsapp_notification(config, payload)
+                env.flush_all()
+                cr.precommit.run()
+                latencies.append(time.perf_counter() - op_start)
+                queries.append(cr.sql_log_count - query_start)
+                if instrumentation.totals().get('chatbot.decide', {}).get('count', 0) > decided:
+                    decision = instrumentation.recent_records(limit=1, operation='chatbot.decide')[0]
+                    decisions.append(decision['total_ms'] / 1000.0)
+                replies = sink.collect()
+                expected = step.get('expect')
+                if expected and not any(expected in (reply['body'] or '') for reply in replies):
+                    failures.append({
+                        'conversation': conversation_index, 'step': step_index, 'number': number,
+                        'expected': expected, 'replies': [reply['body'] for reply in replies],
+                    })
+    elapsed = time.perf_counter() - started
+    return {
+        'inbound': summarize(latencies, elapsed, queries),
+        'decision': summarize(decisions, elapsed),
+    }, len(sink.messages), failures
+
+
+def main(argv=None):
+    parser = add_odoo_arguments(argparse.ArgumentParser(description=__doc__.split('\n\n')[0]))
+    parser.add_argument('--script', help="JSON script with rules and conversations (default: built-in order flow)")
+    parser.add_argument('--rules', type=int, default=0, help="Filler rules added to the script's rules")
+    parser.add_argument('--users', type=int, default=100, help="Distinct WhatsApp ids playing every conversation")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    script = DEFAULT_FLOW
+    if args.script:
+        with open(args.script) as script_file:
+            script = json.load(script_file)
+
+    with odoo_environment(args) as env:
+        config = prepare_config(env)
+        prepare_rules(env, config, script['rules'] + filler_rules(args.rules))
+        env.flush_all()
+        results, replies, failures = simulate(env, config, script['conversations'], args.users, seed=args.seed)
+    emit_report({
+        'benchmark': 'chatbot_simulator',
+        'parameters': {key: value for key, value in vars(args).items() if key not in ('config', 'json_path')},
+        'replies': replies,
+        'failures': failures,
+        'results': results,
+    }, args.json_path)
+    if failures:
+        print(f"{len(failures)} expectation(s) failed, first: {failures[0]}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
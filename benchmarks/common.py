@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+Shared helpers for the WhatsApp benchmark scripts: Odoo environment setup on
+a test database, percentile statistics and report output.
+"""
+import contextlib
+import json
+import math
+import sys
+
+WORDS = (
+    "hello", "order", "status", "price", "delivery", "thanks", "invoice", "help",
+    "refund", "tomorrow", "please", "address", "payment", "available", "when", "today",
+)
+
+
+def add_odoo_arguments(parser):
+    """Add the options needed to open an Odoo database to an argparse parser."""
+    parser.add_argument('-d', '--database', required=True, help="Odoo test database with the module installed")
+    parser.add_argument('-c', '--config', help="Odoo configuration file")
+    parser.add_argument('--addons-path', help="Odoo addons path, including this repository")
+    parser.add_argument('--json', dest='json_path', help="Write the machine-readable report to this file ('-' for stdout)")
+    return parser
+
+
+@contextlib.contextmanager
+def odoo_environment(args):
+    """
+    Yield a superuser environment on ``args.database``. Everything done inside
+    is rolled back, so benchmarks never leave data behind.
+    """
+    import odoo
+    from odoo import api, SUPERUSER_ID
+    from odoo.modules.registry import Registry
+
+    odoo_args = ['-d', args.database]
+    if args.config:
+        odoo_args += ['-c', args.config]
+    if args.addons_path:
+        odoo_args += ['--addons-path', args.addons_path]
+    odoo.tools.config.parse_config(odoo_args)
+    registry = Registry(args.database)
+    with registry.cursor() as cr:
+        env = api.Environment(cr, SUPERUSER_ID, {})
+        try:
+            yield env
+        finally:
+            cr.rollback()
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of ``values`` (0 < pct <= 100)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(int(math.ceil(pct / 100.0 * len(ordered))), 1)
+    return ordered[rank - 1]
+
+
+def summarize(latencies, elapsed, queries=None):
+    """Build the throughput/latency (and query count) summary of one benchmark run."""
+    summary = {
+        'count': len(latencies),
+        'elapsed_s': round(elapsed, 4),
+        'throughput_per_s': round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        'latency_ms': {
+            'p50': round(percentile(latencies, 50) * 1000, 3),
+            'p95': round(percentile(latencies, 95) * 1000, 3),
+            'p99': round(percentile(latencies, 99) * 1000, 3),
+            'max': round(max(latencies) * 1000, 3) if latencies else 0.0,
+        },
+    }
+    if queries is not None:
+        summary['queries'] = {
+            'total': sum(queries),
+            'mean': round(sum(queries) / len(queries), 2) if queries else 0.0,
+            'p95': percentile(queries, 95),
+            'max': max(queries) if queries else 0,
+        }
+    return summary
+
+
+def emit_report(report, json_path=None):
+    """Print a human readable report, and write it as JSON when requested."""
+    if json_path == '-':
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+        return
+    for name, summary in report.get('results', {}).items():
+        latency = summary['latency_ms']
+        line = (f"{name:<24} n={summary['count']:<7} {summary['throughput_per_s']:>9.2f}/s  "
+                f"p50={latency['p50']:.2f}ms p95={latency['p95']:.2f}ms p99={latency['p99']:.2f}ms")
+        if 'queries' in summary:
+            line += f"  queries/op={summary['queries']['mean']} (max {summary['queries']['max']})"
+        if 'memory_peak_kb' in summary:
+            line += f"  mem_peak={summary['memory_peak_kb']}KB"
+        print(line)
+    if json_path:
+        with open(json_path, 'w') as report_file:
+            json.dump(report, report_file, indent=2, sort_keys=True)
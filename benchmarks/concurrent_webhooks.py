@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Check that concurrent webhooks from one new number create exactly one
+partner: ``--workers`` threads, each with its own cursor, process an inbound
+message of the same unknown number at the same time, through
+``odoo.service.model.retrying`` like an HTTP worker does, so the losers of the
+race get the serialization error, are retried and find the winner's partner.
+
+Unlike the benchmarks, every worker commits: the configuration, partners,
+chats and history created are deleted at the end.
+
+Example::
+
+    python -m benchmarks.concurrent_webhooks -d bench_db --addons-path=odoo/addons,. --workers 4 --rounds 20
+"""
+import argparse
+import threading
+
+from .common import add_odoo_arguments, odoo_environment
+from .payloads import WebhookPayloadGenerator
+from .webhook_replay import prepare_config
+
+
+def process_concurrently(registry, config_id, instance_id, number, workers):
+    """Process one inbound message of ``number`` in each of ``workers`` threads at once, return the errors."""
+    from odoo import api, SUPERUSER_ID
+    from odoo.addons.meta_whatsapp_all_in_one.controller.main_controller import WhatsAppWebhook
+    from odoo.service.model import retrying
+
+    generator = WebhookPayloadGenerator(instance_id)
+    payloads = []
+    for _index in range(workers):
+        message, contact = generator.text_message(number=number, body="hello")
+        payloads.append(generator.inbound_payload([message], [contact]))
+    barrier = threading.Barrier(workers)
+    errors = []
+
+    def worker(payload):
+        with registry.cursor() as cr:
+            env = api.Environment(cr, SUPERUSER_ID, {})
+
+            def process():
+                WhatsAppWebhook()._process_whatsapp_notification(env['whatsapp.config'].sudo().browse(config_id),
+                                                                 payload)
+
+            barrier.wait()
+            try:
+                retrying(process, env)
+            except Exception as e:
+                errors.append(repr(e))
+
+    threads = [threading.Thread(target=worker, args=(payload,)) for payload in payloads]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return errors
+
+
+def main(argv=None):
+    parser = add_odoo_arguments(argparse.ArgumentParser(description=__doc__.split('\n\n')[0]))
+    parser.add_argument('--workers', type=int, default=4, help="Webhooks processed at the same time per number")
+    parser.add_argument('--rounds', type=int, default=10, help="New numbers to race on")
+    args = parser.parse_args(argv)
+
+    with odoo_environment(args) as env:
+        config = prepare_config(env)
+        config_id, instance_id = config.id, config.instance_id
+        env.cr.commit()
+        registry = env.registry
+        failures = []
+        try:
+            for index in range(args.rounds):
+                number = '4917%08d' % index
+                errors = process_concurrently(registry, config_id, instance_id, number, args.workers)
+                env.invalidate_all()
+                key = env['res.partner'].normalize_phone_number(number)
+                count = env['res.partner'].sudo().search_count(
+                    ['|', ('normalized_mobile', '=', key), ('normalized_phone', '=', key)])
+                if count != 1 or errors:
+                    failures.append({'number': number, 'partners': count, 'errors': errors})
+        finally:
+            env.invalidate_all()
+            History = env['whatsapp.message.history'].sudo()
+            partners = History.search([('config_id', '=', config_id)]).partner_id
+            env['discuss.channel'].sudo().search([('whatsapp_config_id', '=', config_id)]).unlink()
+            History.search([('config_id', '=', config_id)]).unlink()
+            partners.unlink()
+            env['whatsapp.config'].sudo().browse(config_id).unlink()
+            env.cr.commit()
+
+    print(f"{args.rounds} numbers raced by {args.workers} webhooks each: {len(failures)} failure(s)")
+    for failure in failures:
+        print(failure)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""
+Local stand-in for the Meta Graph API endpoints used by the connector.
+Point ``whatsapp.config.api_url`` at ``http://127.0.0.1:<port>/v20.0``.
+
+Supported endpoints: message sends, media upload/lookup/download, message
+template listing (paginated) and creation, phone number details and the
+business profile. Latency, jitter and 429/5xx error rates are configurable.
+
+Run standalone::
+
+    python -m benchmarks.mock_graph_api --port 8765 --latency-ms 80 --error-429 0.01
+"""
+import argparse
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+MEDIA_CONTENT = b'\x89PNG\r\n\x1a\n' + bytes(range(256)) * 64
+
+
+class MockGraphAPIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def options(self):
+        return self.server.options
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _simulate(self):
+        """Apply latency and injected failures. Returns True when the request was answered with an error."""
+        options = self.options
+        delay = options['latency_ms'] + random.uniform(0, options['jitter_ms'])
+        if delay:
+            time.sleep(delay / 1000.0)
+        self.server.stats['requests'] += 1
+        roll = random.random()
+        if roll < options['error_429']:
+            self.server.stats['429'] += 1
+            self._send_json(429, {'error': {
+                'message': '(#130429) Rate limit hit', 'type': 'OAuthException', 'code': 130429,
+            }}, {'X-Business-Use-Case-Usage': json.dumps({
+                'BENCH': [{'type': 'whatsapp', 'call_count': 100, 'total_cputime': 100,
+                           'total_time': 100, 'estimated_time_to_regain_access': 1}],
+            })})
+            return True
+        if roll < options['error_429'] + options['error_5xx']:
+            self.server.stats['5xx'] += 1
+            self._send_json(503, {'error': {'message': 'Service temporarily unavailable', 'code': 2}})
+            return True
+        return False
+
+    def _usage_headers(self):
+        usage = min(self.server.stats['requests'] % 100, 99)
+        return {'X-App-Usage': json.dumps({'call_count': usage, 'total_cputime': usage // 2, 'total_time': usage // 2})}
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = [part for part in url.path.split('/') if part]
+        if parts and parts[0] == 'download':
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/png')
+            self.send_header('Content-Length', str(len(MEDIA_CONTENT)))
+            self.end_headers()
+            self.wfile.write(MEDIA_CONTENT)
+            return
+        if self._simulate():
+            return
+        headers = self._usage_headers()
+        parts = parts[1:]
+        if len(parts) == 2 and parts[1] == 'message_templates':
+            query = parse_qs(url.query)
+            offset = int(query.get('after', ['0'])[0])
+            page_size = self.options['page_size']
+            total = self.options['templates']
+            data = [{
+                'id': str(100000 + index),
+                'name': f'bench_template_{index}',
+                'language': 'en_US',
+                'status': 'APPROVED',
+                'category': 'UTILITY',
+                'parameter_format': 'POSITIONAL',
+                'components': [{'type': 'BODY', 'text': f'Benchmark template {index}'}],
+            } for index in range(offset, min(offset + page_size, total))]
+            body = {'data': data, 'paging': {'cursors': {'before': str(offset), 'after': str(offset + len(data))}}}
+            if offset + page_size < total:
+                body['paging']['next'] = (f"http://{self.headers.get('Host')}{url.path}"
+                                          f"?limit={page_size}&after={offset + page_size}")
+            self._send_json(200, body, headers)
+        elif len(parts) == 2 and parts[1] == 'whatsapp_business_profile':
+            self._send_json(200, {'data': [{
+                'messaging_product': 'whatsapp', 'address': 'Bench street', 'description': 'Benchmark',
+                'vertical': 'OTHER', 'about': 'Benchmark', 'email': 'bench@example.com', 'websites': [],
+            }]}, headers)
+        elif len(parts) == 1 and parts[0].startswith('media-'):
+            self._send_json(200, {
+                'messaging_product': 'whatsapp',
+                'url': f"http://{self.headers.get('Host')}/download/{parts[0]}",
+                'mime_type': 'image/png',
+                'file_size': len(MEDIA_CONTENT),
+                'id': parts[0],
+            }, headers)
+        elif len(parts) == 1:
+            self._send_json(200, {
+                'verified_name': 'Benchmark', 'code_verification_status': 'VERIFIED',
+                'display_phone_number': '+1 555-000-0000', 'quality_rating': 'GREEN',
+                'platform_type': 'CLOUD_API', 'throughput': {'level': 'STANDARD'}, 'id': parts[0],
+            }, headers)
+        else:
+            self._send_json(404, {'error': {'message': 'Unknown path', 'code': 100}})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        body = self._read_body()
+        if self._simulate():
+            return
+        headers = self._usage_headers()
+        parts = [part for part in url.path.split('/') if part][1:]
+        if len(parts) == 2 and parts[1] == 'messages':
+            payload = json.loads(body or b'{}')
+            message_id = f"wamid.MOCK{next(self.server.counter):012d}"
+            self.server.stats['messages'] += 1
+            self._send_json(200, {
+                'messaging_product': 'whatsapp',
+                'contacts': [{'input': payload.get('to'), 'wa_id': payload.get('to')}],
+                'messages': [{'id': message_id}],
+            }, headers)
+        elif len(parts) == 2 and parts[1] == 'media':
+            self.server.stats['media'] += 1
+            self._send_json(200, {'id': f"media-{next(self.server.counter)}"}, headers)
+        elif len(parts) == 2 and parts[1] == 'message_templates':
+            self._send_json(200, {'id': str(next(self.server.counter)), 'status': 'PENDING', 'category': 'UTILITY'},
+                            headers)
+        elif len(parts) == 1 and re.match(r'^\d+$', parts[0]):
+            self._send_json(200, {'success': True}, headers)
+        else:
+            self._send_json(404, {'error': {'message': 'Unknown path', 'code': 100}})
+
+
+class MockGraphAPIServer:
+    """Threaded mock Graph API server, usable as a context manager."""
+
+    def __init__(self, host='127.0.0.1', port=0, version='v20.0', latency_ms=0.0, jitter_ms=0.0,
+                 error_429=0.0, error_5xx=0.0, page_size=25, templates=60):
+        self.version = version
+        self.httpd = ThreadingHTTPServer((host, port), MockGraphAPIHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.options = {
+            'latency_ms': latency_ms, 'jitter_ms': jitter_ms, 'error_429': error_429,
+            'error_5xx': error_5xx, 'page_size': page_size, 'templates': templates,
+        }
+        self.httpd.counter = itertools.count(1)
+        self.httpd.stats = {'requests': 0, 'messages': 0, 'media': 0, '429': 0, '5xx': 0}
+        self.thread = None
+
+    @property
+    def api_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/{self.version}"
+
+    @property
+    def stats(self):
+        return dict(self.httpd.stats)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='mock-graph-api', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local Meta Graph API stand-in")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--jitter-ms', type=float, default=0.0)
+    parser.add_argument('--error-429', type=float, default=0.0, help="Share of requests answered with 429")
+    parser.add_argument('--error-5xx', type=float, default=0.0, help="Share of requests answered with 503")
+    parser.add_argument('--page-size', type=int, default=25, help="Templates per page")
+    parser.add_argument('--templates', type=int, default=60, help="Number of templates to list")
+    args = parser.parse_args(argv)
+    server = MockGraphAPIServer(
+        args.host, args.port, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+        error_429=args.error_429, error_5xx=args.error_5xx, page_size=args.page_size, templates=args.templates,
+    )
+    print(f"Mock Graph API listening on {server.api_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == '__main__':
+    main()
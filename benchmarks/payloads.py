@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+Generator of realistic Meta WhatsApp Cloud API webhook payloads.
+"""
+import random
+import time
+
+from .common import WORDS
+
+
+class WebhookPayloadGenerator:
+    """
+    Produce webhook payloads shaped like the ones Meta posts to
+    ``/whatsapp/webhook/<config_id>``: inbound text messages, replies with
+    ``context.id``, and bursts of status updates for outbound messages, from
+    a mix of known and brand new contacts.
+    """
+
+    def __init__(self, phone_number_id, display_phone_number='15550000000', seed=None,
+                 mix=None, new_contact_ratio=0.2, known_numbers=None, batch_size=1):
+        self.random = random.Random(seed)
+        self.phone_number_id = phone_number_id
+        self.display_phone_number = display_phone_number
+        self.mix = mix or {'text': 0.6, 'reply': 0.15, 'status': 0.25}
+        self.new_contact_ratio = new_contact_ratio
+        self.known_numbers = list(known_numbers or [])
+        self.batch_size = batch_size
+        self.sent_message_ids = []
+        self.inbound_message_ids = []
+        self._counter = 0
+
+    def _next_id(self, prefix='wamid'):
+        self._counter += 1
+        return f"{prefix}.BENCH{self._counter:012d}{self.random.getrandbits(32):08X}"
+
+    def _pick_number(self):
+        if not self.known_numbers or self.random.random() < self.new_contact_ratio:
+            number = '91%010d' % self.random.randrange(10 ** 9, 10 ** 10)
+            self.known_numbers.append(number)
+            return number
+        return self.random.choice(self.known_numbers)
+
+    def _text(self):
+        return ' '.join(self.random.choice(WORDS) for _ in range(self.random.randint(2, 12)))
+
+    def _envelope(self, value):
+        value = dict(value, messaging_product='whatsapp', metadata={
+            'display_phone_number': self.display_phone_number,
+            'phone_number_id': self.phone_number_id,
+        })
+        return {
+            'object': 'whatsapp_business_account',
+            'entry': [{
+                'id': 'BENCH_WABA',
+                'changes': [{'field': 'messages', 'value': value}],
+            }],
+        }
+
+    def text_message(self, number=None, body=None, reply_to=None):
+        """Return the value of an inbound text message and the contact it comes from."""
+        number = number or self._pick_number()
+        message_id = self._next_id()
+        self.inbound_message_ids.append(message_id)
+        message = {
+            'from': number,
+            'id': message_id,
+            'timestamp': str(int(time.time())),
+            'type': 'text',
+            'text': {'body': body or self._text()},
+        }
+        if reply_to:
+            message['context'] = {'from': self.display_phone_number, 'id': reply_to}
+        contact = {'profile': {'name': f"Bench {number[-4:]}"}, 'wa_id': number}
+        return message, contact
+
+    def button_message(self, number, payload, text=None):
+        """Return the value of a quick reply button press and the contact it comes from."""
+        message_id = self._next_id()
+        self.inbound_message_ids.append(message_id)
+        message = {
+            'from': number,
+            'id': message_id,
+            'timestamp': str(int(time.time())),
+            'type': 'button',
+            'button': {'payload': payload, 'text': text or payload},
+        }
+        contact = {'profile': {'name': f"Bench {number[-4:]}"}, 'wa_id': number}
+        return message, contact
+
+    def inbound_payload(self, messages, contacts):
+        """Wrap inbound messages and their contacts in a webhook envelope."""
+        return self._envelope({'contacts': contacts, 'messages': messages})
+
+    def messages_payload(self, kind='text'):
+        messages, contacts = [], []
+        for _ in range(self.batch_size):
+            reply_to = None
+            if kind == 'reply':
+                pool = self.sent_message_ids or self.inbound_message_ids
+                reply_to = self.random.choice(pool) if pool else None
+            message, contact = self.text_message(reply_to=reply_to)
+            messages.append(message)
+            contacts.append(contact)
+        return self._envelope({'contacts': contacts, 'messages': messages})
+
+    def status_payload(self):
+        statuses = []
+        for _ in range(self.batch_size):
+            if self.sent_message_ids and self.random.random() < 0.8:
+                message_id = self.random.choice(self.sent_message_ids)
+            else:
+                message_id = self._next_id()
+                self.sent_message_ids.append(message_id)
+            statuses.append({
+                'id': message_id,
+                'status': self.random.choice(('sent', 'delivered', 'read')),
+                'timestamp': str(int(time.time())),
+                'recipient_id': self._pick_number(),
+                'conversation': {'id': self._next_id('conv'), 'origin': {'type': 'service'}},
+                'pricing': {'billable': True, 'pricing_model': 'CBP', 'category': 'service'},
+            })
+        return self._envelope({'statuses': statuses})
+
+    def next_payload(self):
+        """Return ``(kind, payload)`` for the next payload of the configured mix."""
+        kind = self.random.choices(list(self.mix), weights=list(self.mix.values()))[0]
+        if kind == 'status':
+            return kind, self.status_payload()
+        return kind, self.messages_payload(kind)
+
+    def __iter__(self):
+        while True:
+            yield self.next_payload()
+
+
+def parse_mix(value):
+    """Parse a ``text=0.6,reply=0.15,status=0.25`` command line mix."""
+    mix = {}
+    for item in value.split(','):
+        kind, _sep, weight = item.partition('=')
+        mix[kind.strip()] = float(weight)
+    return mix
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark the outbound send path (``message.configuration.action_send_message``
+and ``_upload_media``) against the local Graph API stand-in, and report
+per-message latency, throughput and peak Python memory as JSON.
+
+Everything runs in one transaction that is rolled back at the end.
+
+Example::
+
+    python -m benchmarks.send_benchmark -d bench_db --addons-path=odoo/addons,. \\
+        --latency-ms 80 --error-5xx 0.01 --count 200 --broadcast-size 500 --json send.json
+"""
+import argparse
+import base64
+import time
+import tracemalloc
+
+from .common import add_odoo_arguments, emit_report, odoo_environment, summarize
+from .mock_graph_api import MEDIA_CONTENT, MockGraphAPIServer
+
+
+def prepare(env, api_url, recipients):
+    """
+    Create a configuration pointing at the mock API, an operator and recipient
+    partners with an open conversation window, so freeform sends are not
+    refused. The pair rate limit is disabled: every scenario sends to the same
+    recipients over and over.
+    """
+    from odoo import fields
+
+    config = env['whatsapp.config'].sudo().create({
+        'name': 'Send benchmark',
+        'api_url': api_url,
+        'instance_id': '100000000000001',
+        'business_account_id': '200000000000001',
+        'access_token': 'bench-token',
+        'app_id': 'bench-app',
+        'app_secret': 'bench-secret',
+        'pair_rate_interval': 0,
+    })
+    admin = env.ref('base.user_admin')
+    admin.write({'allowed_providers': [(4, config.id)], 'default_provider': config.id})
+    config.write({'operator_ids': [(4, admin.id)]})
+    partners = env['res.partner'].create([{
+        'name': f'Send bench {index}',
+        'phone': '+91%010d' % (9000000000 + index),
+        'mobile': '+91%010d' % (9000000000 + index),
+    } for index in range(recipients)])
+    now = fields.Datetime.now()
+    env['whatsapp.conversation.window'].sudo()._touch(config.id, {partner.id: now for partner in partners})
+    return config, admin, partners
+
+
+def run_scenario(env, name, calls):
+    """Run ``calls`` (callables), timing each one and tracking peak memory."""
+    latencies = []
+    tracemalloc.start()
+    started = time.perf_counter()
+    for call in calls:
+        op_start = time.perf_counter()
+        call()
+        env.flush_all()
+        env.cr.precommit.run()
+        latencies.append(time.perf_counter() - op_start)
+    elapsed = time.perf_counter() - started
+    _current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    summary = summarize(latencies, elapsed)
+    summary['memory_peak_kb'] = peak // 1024
+    return name, summary
+
+
+def main(argv=None):
+    parser = add_odoo_arguments(argparse.ArgumentParser(description=__doc__.split('\n\n')[0]))
+    parser.add_argument('--count', type=int, default=100, help="Single sends and media sends to run")
+    parser.add_argument('--broadcast-size', type=int, default=200, help="Recipients of the broadcast scenario")
+    parser.add_argument('--latency-ms', type=float, default=0.0, help="Mock Graph API latency")
+    parser.add_argument('--jitter-ms', type=float, default=0.0)
+    parser.add_argument('--error-429', type=float, default=0.0)
+    parser.add_argument('--error-5xx', type=float, default=0.0)
+    args = parser.parse_args(argv)
+
+    with MockGraphAPIServer(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                            error_429=args.error_429, error_5xx=args.error_5xx) as server, \
+            odoo_environment(args) as env:
+        config, admin, partners = prepare(env, server.api_url, max(args.broadcast_size, 1))
+        Wizard = env['message.configuration'].with_user(admin)
+        attachment = base64.b64encode(MEDIA_CONTENT)
+
+        def send(partner, **values):
+            return lambda: Wizard.create(dict({
+                'recipient': partner.id,
+                'config_id': config.id,
+                'number': 'mobile',
+            }, **values)).action_send_message()
+
+        first = partners[0]
+        results = dict([
+            run_scenario(env, 'single_text', [
+                send(first, message=f'Benchmark message {index}') for index in range(args.count)
+            ]),
+            run_scenario(env, 'broadcast_text', [
+                send(partner, message='Benchmark broadcast') for partner in partners[:args.broadcast_size]
+            ]),
+            run_scenario(env, 'media_upload', [
+                lambda: Wizard.create({
+                    'recipient': first.id, 'config_id': config.id,
+                    'attachment': attachment, 'attachment_filename': 'bench.png',
+                })._upload_media()
+                for _index in range(args.count)
+            ]),
+            run_scenario(env, 'media_send', [
+                send(first, attachment=attachment, attachment_filename='bench.png') for _index in range(args.count)
+            ]),
+        ])
+        mock_stats = server.stats
+    emit_report({
+        'benchmark': 'send',
+        'parameters': {key: value for key, value in vars(args).items() if key not in ('config', 'json_path')},
+        'mock_graph_api': mock_stats,
+        'results': results,
+    }, args.json_path)
+
+
+if __name__ == '__main__':
+    main()
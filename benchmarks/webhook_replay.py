@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Replay generated Meta webhook payloads against
+``WhatsAppWebhook._process_whatsapp_notification`` on an Odoo test database
+and report throughput, p50/p95/p99 latency and SQL queries per payload.
+
+Everything runs in one transaction that is rolled back at the end.
+
+Example::
+
+    python -m benchmarks.webhook_replay -d bench_db --addons-path=odoo/addons,. \\
+        --count 2000 --rate 50 --mix text=0.6,reply=0.15,status=0.25 --json webhook.json
+"""
+import argparse
+import time
+
+from .common import add_odoo_arguments, emit_report, odoo_environment, summarize
+from .payloads import WebhookPayloadGenerator, parse_mix
+
+
+def prepare_config(env):
+    """Create a throwaway WhatsApp configuration the admin user can operate."""
+    config = env['whatsapp.config'].sudo().create({
+        'name': 'Benchmark',
+        'api_url': 'http://127.0.0.1:9/v20.0',
+        'instance_id': 'BENCH_PHONE_ID',
+        'business_account_id': 'BENCH_WABA',
+        'access_token': 'bench-token',
+        'app_id': 'bench-app',
+        'app_secret': 'bench-secret',
+    })
+    admin = env.ref('base.user_admin')
+    admin.write({'allowed_providers': [(4, config.id)], 'default_provider': config.id})
+    config.write({'operator_ids': [(4, admin.id)]})
+    return config
+
+
+def replay(env, config, generator, count, rate=0.0, warmup=20):
+    """
+    Feed ``count`` payloads to the webhook processing at ``rate`` payloads per
+    second (0 for as fast as possible). Returns per-kind and overall summaries.
+    """
+    from odoo.addons.meta_whatsapp_all_in_one.controller.main_controller import WhatsAppWebhook
+
+    webhook = WhatsAppWebhook()
+    cr = env.cr
+    for _ in range(warmup):
+        _kind, payload = generator.next_payload()
+        webhook._process_whatsapp_notification(config, payload)
+        env.flush_all()
+        cr.precommit.run()
+
+    interval = 1.0 / rate if rate else 0.0
+    latencies, queries = {}, {}
+    started = time.perf_counter()
+    next_at = started
+    for _ in range(count):
+        if interval:
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            next_at += interval
+        kind, payload = generator.next_payload()
+        query_start = cr.sql_log_count
+        op_start = time.perf_counter()
+        webhook._process_whatsapp_notification(config, payload)
+        env.flush_all()
+        cr.precommit.run()
+        latencies.setdefault(kind, []).append(time.perf_counter() - op_start)
+        queries.setdefault(kind, []).append(cr.sql_log_count - query_start)
+    elapsed = time.perf_counter() - started
+
+    results = {kind: summarize(latencies[kind], elapsed, queries[kind]) for kind in latencies}
+    results['all'] = summarize(
+        [value for values in latencies.values() for value in values], elapsed,
+        [value for values in queries.values() for value in values],
+    )
+    return results
+
+
+def main(argv=None):
+    parser = add_odoo_arguments(argparse.ArgumentParser(description=__doc__.split('\n\n')[0]))
+    parser.add_argument('--count', type=int, default=1000, help="Number of payloads to replay")
+    parser.add_argument('--rate', type=float, default=0.0, help="Target payloads per second, 0 for unthrottled")
+    parser.add_argument('--mix', type=parse_mix, default=None, help="Payload mix, e.g. text=0.6,reply=0.15,status=0.25")
+    parser.add_argument('--new-contact-ratio', type=float, default=0.2, help="Share of messages from unknown numbers")
+    parser.add_argument('--batch-size', type=int, default=1, help="Messages or statuses per payload")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    with odoo_environment(args) as env:
+        config = prepare_config(env)
+        generator = WebhookPayloadGenerator(
+            config.instance_id, seed=args.seed, mix=args.mix,
+            new_contact_ratio=args.new_contact_ratio, batch_size=args.batch_size,
+        )
+        results = replay(env, config, generator, args.count, rate=args.rate)
+    emit_report({
+        'benchmark': 'webhook_replay',
+        'parameters': {key: value for key, value in vars(args).items() if key not in ('config', 'json_path')},
+        'results': results,
+    }, args.json_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,2 +1,3 @@
 from . import models
-from . import controller
\ No newline at end of file
+from . import controller
+from . import cli
\ No newline at end of file
@@ -20,11 +20,15 @@
     ],
     "data": [
         'security/ir.model.access.csv',
+        'data/ir_cron.xml',
         'views/configuration.xml',
         'views/message_template.xml',
         'views/message_configure.xml',
         'views/message_history.xml',
+        'views/message_history_index.xml',
         'views/res_partner.xml',
+        'views/outbound_message.xml',
+        'views/partner_import.xml',
     ],
     # 'assets': {
     #     'web.assets_backend': [
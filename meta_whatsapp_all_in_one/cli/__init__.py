@@ -0,0 +1 @@
+from . import import_partners
@@ -1,13 +1,17 @@
 import json
 import hmac
 import hashlib
+import psycopg2
 from odoo import http
 from odoo.http import request
-from odoo.exceptions import ValidationError
+from odoo.exceptions import UserError, ValidationError
 import logging
 # -*- coding: utf-8 -*-
 from odoo import models, fields, api, _
 from datetime import datetime
+from ..models.media_download import MEDIA_MESSAGE_TYPES
+from ..tools import LazyLog, instrumented, log_sampled, payload_digest
+from ..tools import history_export, instrumentation
 
 _logger = logging.getLogger(__name__)
 
@@ -25,17 +29,120 @@ class WhatsAppWebhook(http.Controller):
         - GET: Verify the webhook endpoint.
         - POST: Process incoming message notifications.
         """
-        # Fetch the configuration record
-        config = request.env['whatsapp.config'].sudo().browse(config_id)
-        if not config.exists():
+        # The cached app secret also tells whether the configuration exists
+        app_secret = request.env['whatsapp.config']._get_webhook_app_secret(config_id)
+        if app_secret is None:
             _logger.error("WhatsApp configuration ID %s not found.", config_id)
-            return json.dumps({'error': 'Invalid configuration'}, status=404)
+            return request.make_json_response({'error': 'Invalid configuration'}, status=404)
+
+        if request.httprequest.method == 'POST' and not self._check_signature([app_secret]):
+            return request.make_json_response({'error': 'Invalid signature'}, status=403)
+        if request.httprequest.method == 'POST' and not app_secret:
+            self._warn_unsigned(config_id)
 
+        config = request.env['whatsapp.config'].sudo().browse(config_id)
         if request.httprequest.method == 'GET':
             return self._handle_verification_request(config, kwargs)
         elif request.httprequest.method == 'POST':
             return self._handle_event_notification(config)
 
+    @http.route('/whatsapp/webhook', type='http', auth='public', methods=['GET', 'POST'], csrf=False)
+    def whatsapp_app_webhook(self, **kwargs):
+        """
+        Single webhook for all the configurations of a Meta app: every change
+        is routed to its configuration by ``metadata.phone_number_id``.
+        - GET: Verify the webhook endpoint with the verify token of any configuration.
+        - POST: Process the notifications of all configurations in one pass.
+        """
+        Config = request.env['whatsapp.config']
+        if request.httprequest.method == 'GET':
+            config = Config.sudo().search([('webhook_token', '=', kwargs.get('hub.verify_token'))], limit=1)
+            if not config:
+                _logger.error("Invalid verify token for the shared WhatsApp webhook")
+                return json.dumps({'error': 'Invalid verify token'})
+            return self._handle_verification_request(config, kwargs)
+
+        routing = Config._get_webhook_routing()
+        secrets = {app_secret for _config_id, app_secret in routing.values()}
+        signed_secret = self._check_signature(secrets - {''})
+        if not signed_secret and '' not in secrets:
+            return request.make_json_response({'error': 'Invalid signature'}, status=403)
+        payload = request.httprequest.data
+        if not payload:
+            return request.make_json_response({'error': 'Empty payload'}, status=400)
+        try:
+            data = json.loads(payload.decode('utf-8'))
+        except json.JSONDecodeError:
+            _logger.error("Invalid JSON payload on the shared WhatsApp webhook")
+            return json.dumps({'error': 'Invalid JSON'})
+        log_sampled(_logger, logging.INFO, request.env, "Received shared webhook payload: %s",
+                    LazyLog(payload_digest, payload))
+
+        # each configuration in its own savepoint: an error rolls back only its changes
+        for config_id, config_data in self._split_by_config(data, routing, signed_secret).items():
+            config = Config.sudo().browse(config_id)
+            try:
+                with request.env.cr.savepoint():
+                    self._process_whatsapp_notification(config, config_data)
+            except psycopg2.OperationalError:
+                # concurrency errors are retried by Odoo; anything else must not be acknowledged to Meta
+                raise
+            except Exception as e:
+                _logger.error("Error processing webhook notification for config ID %s: %s", config_id, str(e))
+        return json.dumps({'status': 'received'})
+
+    def _split_by_config(self, data, routing, signed_secret):
+        """
+        Group the changes of a shared webhook payload per configuration, keyed
+        by the phone number id of their metadata. Changes of unknown numbers,
+        or whose configuration has another app secret than the one the payload
+        was signed with, are dropped.
+        """
+        payloads = {}
+        for entry in data.get('entry', []):
+            for change in entry.get('changes', []):
+                phone_number_id = change.get('value', {}).get('metadata', {}).get('phone_number_id')
+                config_id, app_secret = routing.get(phone_number_id, (None, None))
+                if config_id is None:
+                    _logger.warning("No WhatsApp configuration for phone number ID %s", phone_number_id)
+                    continue
+                if app_secret and app_secret != signed_secret:
+                    _logger.warning("Invalid signature for config ID %s on the shared webhook", config_id)
+                    continue
+                if not app_secret:
+                    self._warn_unsigned(config_id)
+                config_payload = payloads.setdefault(config_id, {'object': data.get('object'), 'entry': []})
+                config_payload['entry'].append(dict(entry, changes=[change]))
+        return payloads
+
+    def _check_signature(self, app_secrets):
+        """
+        Check the X-Hub-Signature-256 header against the raw request body,
+        before any parsing. Returns the app secret among ``app_secrets`` the
+        body was signed with, True when the only secret is empty (configuration
+        without app secret, not verified), and False otherwise.
+        """
+        app_secrets = list(app_secrets)
+        if app_secrets == ['']:
+            return True
+        signature = request.httprequest.headers.get('X-Hub-Signature-256', '')
+        if not signature.startswith('sha256='):
+            return False
+        body = request.httprequest.get_data()
+        for app_secret in app_secrets:
+            if not app_secret:
+                continue
+            expected = hmac.new(app_secret.encode('utf-8'), body, hashlib.sha256).hexdigest()
+            if hmac.compare_digest(signature[7:], expected):
+                return app_secret
+        return False
+
+    def _warn_unsigned(self, config_id):
+        """Log (sampled) that a configuration without app secret accepted an unverified webhook request."""
+        log_sampled(_logger, logging.WARNING, request.env,
+                    "WhatsApp configuration %s has no App Secret: its webhook requests are accepted "
+                    "without signature verification", config_id)
+
     def _handle_verification_request(self, config, kwargs):
         """
         Handle webhook verification requests (GET) from Meta.
@@ -55,7 +162,7 @@ class WhatsAppWebhook(http.Controller):
                 _logger.error("Invalid mode: %s", mode)
                 return json.dumps({'error': 'Invalid mode'})
 
-            if verify_token != config.webhook_token:
+            if verify_token != config._snapshot().webhook_token:
                 _logger.error("Invalid verify token for config ID %s", config.id)
                 return json.dumps({'error': 'Invalid verify token'})
 
@@ -79,7 +186,8 @@ class WhatsAppWebhook(http.Controller):
 
             # Parse JSON payload
             data = json.loads(payload.decode('utf-8'))
-            _logger.info("Received webhook payload for config ID %s: %s", config.id, data)
+            log_sampled(_logger, logging.INFO, request.env, "Received webhook payload for config ID %s: %s",
+                        config.id, LazyLog(payload_digest, payload))
 
             self._process_whatsapp_notification(config, data)
 
@@ -88,11 +196,21 @@ class WhatsAppWebhook(http.Controller):
         except json.JSONDecodeError:
             _logger.error("Invalid JSON payload for config ID %s", config.id)
             return json.dumps({'error': 'Invalid JSON'})
+        except psycopg2.OperationalError:
+            # concurrency errors are retried by Odoo; anything else must not be acknowledged to Meta
+            raise
         except Exception as e:
             _logger.error("Error processing webhook notification: %s", str(e))
             return json.dumps({'error': str(e)})
 
+    @instrumented('webhook.process_notification')
     def _process_whatsapp_notification(self, config, data):
+        """
+        Process a parsed webhook payload for the given (sudo) configuration.
+        Only uses the configuration's environment, so it can also be replayed
+        outside of an HTTP request.
+        """
+        env = config.env
 
         entries = data.get('entry', [])
         for entry in entries:
@@ -103,6 +221,19 @@ class WhatsAppWebhook(http.Controller):
 
                     messages = value.get('messages', [])
                     contacts = value.get('contacts', [])
+                    statuses = value.get('statuses', [])
+                    # Only statuses of messages missing from the history need their recipient
+                    known_message_ids = set(env['whatsapp.message.history'].sudo().search([
+                        ('message_id', 'in', [status.get('id') for status in statuses]),
+                        ('config_id', '=', config.id),
+                    ]).mapped('message_id')) if statuses else set()
+                    partners = self._find_or_create_partners(
+                        [message.get('from') for message in messages]
+                        + [status.get('recipient_id') for status in statuses
+                           if status.get('id') not in known_message_ids],
+                        contacts, env)
+                    inbound_times = {}
+                    inbound = []
                     for message in messages:
                         from_number = message.get('from')
                         message_type = message.get('type')
@@ -118,13 +249,13 @@ class WhatsAppWebhook(http.Controller):
                         except (ValueError, TypeError):
                             message_datetime = fields.Datetime.now()
 
-                        partner = self._find_or_create_partner(from_number, contacts)
-                        authorized_users = request.env['res.users'].sudo().search([
+                        partner = partners.get(from_number) or self._find_or_create_partner(from_number, contacts, env)
+                        authorized_users = env['res.users'].sudo().search([
                             '|',
                             ('allowed_providers', 'in', [config.id]),
                             ('default_provider', '=', config.id),
                         ], limit=1)
-                        _logger.info(authorized_users)
+                        _logger.debug("Authorized user for config ID %s: %s", config.id, authorized_users.id)
                         create_vals = {
                             'number': from_number,
                             'partner_id': partner.id if partner else False,
@@ -138,33 +269,56 @@ class WhatsAppWebhook(http.Controller):
                         }
                         if reply_to_message_id:
                             create_vals['reply_to_message_id'] = reply_to_message_id
-                        history_record = request.env['whatsapp.message.history'].sudo().create(create_vals)
+                        history_record = env['whatsapp.message.history'].sudo().create(create_vals)
 
+                        mes = False
                         if partner:
+                            inbound_times[partner.id] = max(inbound_times.get(partner.id, message_datetime),
+                                                            message_datetime)
                             channel = self._get_or_create_chat_channel(partner, config.id)
                             if channel:
                                 message_vals = {
                                     'model': 'discuss.channel',
                                     'res_id': channel.id,
                                     'message_type': 'comment',
-                                    'subtype_id': request.env.ref('mail.mt_comment').id,
+                                    'subtype_id': env.ref('mail.mt_comment').id,
                                     'body': message_content,
                                     'author_id': partner.id,
                                     'date': message_datetime,
                                     'whatsapp_message_id': message_id,
                                 }
                                 if reply_to_message_id:
-                                    parent_message = request.env['mail.message'].sudo().search([
+                                    parent_message = env['mail.message'].sudo().search([
                                         ('whatsapp_message_id', '=', reply_to_message_id),
                                         ('model', '=', 'discuss.channel'),
                                         ('res_id', '=', channel.id),
                                     ], limit=1)
                                     if parent_message:
                                         message_vals['parent_id'] = parent_message.id
-                                mes = request.env['mail.message'].sudo().create(message_vals)
-                                _logger.info(mes)
+                                mes = env['mail.message'].sudo().create(message_vals)
+                                _logger.debug("Created mail.message %s for WhatsApp message %s", mes.id, message_id)
+                                channel._whatsapp_queue_notification(
+                                    'discuss.channel/transient_message', {
+                                        'body': message_content,
+                                        'author_id': partner.id,
+                                        'channel_id': channel.id,
+                                    }
+                                )
+
+                        if message_type in MEDIA_MESSAGE_TYPES and message.get(message_type, {}).get('id'):
+                            env['whatsapp.media.download'].sudo()._enqueue(
+                                config, message_type, message[message_type], history_record, mes)
+                        inbound.append({
+                            'message': message,
+                            'type': message_type,
+                            'partner': partner,
+                            'history': history_record,
+                        })
+
+                    env['whatsapp.conversation.window'].sudo()._touch(config.id, inbound_times)
+                    if inbound:
+                        config._handle_inbound_messages(inbound)
 
-                    statuses = value.get('statuses', [])
                     for status_update in statuses:
                         message_id = status_update.get('id')
                         status = status_update.get('status')
@@ -180,11 +334,11 @@ class WhatsAppWebhook(http.Controller):
                         valid_statuses = ['sent', 'delivered', 'read', 'failed']
                         model_status = status if status in valid_statuses else 'failed'
 
-                        history_record = request.env['whatsapp.message.history'].sudo().search([
+                        history_record = env['whatsapp.message.history'].sudo().search([
                             ('message_id', '=', message_id),
                             ('config_id', '=', config.id),
                         ], limit=1)
-                        _logger.info(history_record)
+                        _logger.debug("History record for WhatsApp message %s: %s", message_id, history_record.id)
 
                         if history_record:
                             update_vals = {
@@ -195,13 +349,14 @@ class WhatsAppWebhook(http.Controller):
                                 update_vals['conversation_id'] = conversation_id
                             history_record.write(update_vals)
                         else:
-                            partner = self._find_or_create_partner(recipient_number, contacts)
-                            authorized_users = request.env['res.users'].sudo().search([
+                            partner = partners.get(recipient_number) or self._find_or_create_partner(
+                                recipient_number, contacts, env)
+                            authorized_users = env['res.users'].sudo().search([
                                 '|',
                                 ('allowed_providers', 'in', [config.id]),
                                 ('default_provider', '=', config.id),
                             ], limit=1)
-                            _logger.info(authorized_users)
+                            _logger.debug("Authorized user for config ID %s: %s", config.id, authorized_users.id)
                             create_vals = {
                                 'number': recipient_number,
                                 'partner_id': partner.id if partner else False,
@@ -213,20 +368,22 @@ class WhatsAppWebhook(http.Controller):
                             }
                             if model_status == 'delivered' and conversation_id:
                                 create_vals['conversation_id'] = conversation_id
-                            request.env['whatsapp.message.history'].sudo().create(create_vals)
+                            env['whatsapp.message.history'].sudo().create(create_vals)
 
+    @instrumented('webhook.get_or_create_chat_channel')
     def _get_or_create_chat_channel(self, partner, config_id=False):
         """
         Find or create a direct message discuss.channel for the given partner.
         """
         if not partner:
             return False
-        authorized_users = request.env['res.users'].sudo().search([
+        env = partner.env
+        authorized_users = env['res.users'].sudo().search([
             '|',
             ('allowed_providers', 'in', [config_id]),
             ('default_provider', '=', config_id),
         ], limit=1)
-        channel = request.env['discuss.channel'].sudo().search([
+        channel = env['discuss.channel'].sudo().search([
             ('channel_type', '=', 'chat'),
             ('whatsapp_config_id', '=', config_id),
             ('channel_member_ids.partner_id', 'in', [authorized_users.partner_id.id]),
@@ -243,44 +400,102 @@ class WhatsAppWebhook(http.Controller):
                 ],
                 'whatsapp_config_id': config_id,
             }
-            channel = request.env['discuss.channel'].sudo().create(channel_vals)
+            channel = env['discuss.channel'].sudo().create(channel_vals)
 
-        _logger.info('Channel created/found: %s (ID: %d, Members: %s)',
-                     channel.name, channel.id, channel.channel_member_ids.mapped('partner_id.name'))
+        log_sampled(_logger, logging.DEBUG, env, 'Channel created/found: %s (ID: %d, Members: %s)',
+                    LazyLog(lambda: channel.name), channel.id,
+                    LazyLog(lambda: channel.channel_member_ids.mapped('partner_id.name')))
         return channel
 
-    def _find_or_create_partner(self, phone_number, contacts):
+    @instrumented('webhook.find_or_create_partners')
+    def _find_or_create_partners(self, phone_numbers, contacts, env=None):
+        """
+        Find or create the res.partner records of all the given phone numbers at
+        once. Unknown numbers are created in one batch, named after the contact
+        profile with the matching wa_id.
+        """
+        env = env or request.env
+        names = {
+            contact.get('wa_id'): contact.get('profile', {}).get('name')
+            for contact in contacts if contact.get('wa_id')
+        }
+        return env['res.partner'].sudo()._whatsapp_find_or_create(
+            [number for number in phone_numbers if number], names)
+
+    def _find_or_create_partner(self, phone_number, contacts, env=None):
+        """
+        Find or create a res.partner record based on the phone number.
+        """
+        if not phone_number:
+            return None
+        return self._find_or_create_partners([phone_number], contacts, env).get(phone_number)
+
+class WhatsAppMetrics(http.Controller):
+    """
+    Expose the hot path instrumentation of the current worker, as JSON or in
+    the Prometheus text format. Restricted to administrators.
+    """
+
+    @http.route('/whatsapp/metrics', type='http', auth='user', methods=['GET'])
+    def whatsapp_metrics(self, limit=100, operation=None, **kwargs):
+        if not request.env.user.has_group('base.group_system'):
+            return request.make_json_response({'error': 'Forbidden'}, status=403)
+        return request.make_json_response({
+            'summary': instrumentation.summary(),
+            'recent': instrumentation.recent_records(limit=int(limit), operation=operation),
+        })
+
+    @http.route('/whatsapp/metrics/prometheus', type='http', auth='user', methods=['GET'])
+    def whatsapp_metrics_prometheus(self, **kwargs):
+        if not request.env.user.has_group('base.group_system'):
+            return request.make_response('Forbidden', status=403)
+        return request.make_response(instrumentation.prometheus_text(), headers=[
+            ('Content-Type', 'text/plain; version=0.0.4; charset=utf-8'),
+        ])
+
+
+class WhatsAppTimeline(http.Controller):
+
+    @http.route('/whatsapp/timeline', type='http', auth='user', methods=['GET'])
+    def whatsapp_timeline(self, partner_id=None, config_id=None, number=None, cursor=None, limit=50, **kwargs):
+        """Keyset-paginated conversation timeline of a contact, see whatsapp.message.history.get_timeline()."""
+        try:
+            timeline = request.env['whatsapp.message.history'].get_timeline(
+                partner_id=int(partner_id) if partner_id else None,
+                config_id=int(config_id) if config_id else None,
+                number=number,
+                cursor=cursor,
+                limit=int(limit),
+            )
+        except (UserError, ValueError) as e:
+            return request.make_json_response({'error': str(e)}, status=400)
+        return request.make_json_response(timeline)
+
+    @http.route('/whatsapp/history/export', type='http', auth='user', methods=['GET'])
+    def whatsapp_history_export(self, format='csv', date_from=None, date_to=None, config_id=None, status=None,
+                                include_body='1', **kwargs):
         """
-        Find or create a res.partner record based on the phone number using a raw SQL query.
+        Stream the message history as CSV (``format=csv``) or gzipped JSON lines
+        (``format=jsonl``), filtered on send date range, configuration and status.
         """
-        # normalized_mobile = request.env['res.partner'].sudo().normalize_phone_number(partner.normalized_mobile)
-        # normalized_phone = request.env['res.partner'].sudo().normalize_phone_number(partner.normalized_phone)
-        received_normalize = request.env['res.partner'].sudo().normalize_phone_number(phone_number)
-        # _logger.info(normalized_mobile)
-        # _logger.info(normalized_phone)
-        _logger.info(received_normalize)
-        # Use raw SQL query to search for a partner where mobile or phone matches the phone_number
-        request.env.cr.execute("""
-            SELECT id
-            FROM res_partner
-            WHERE normalized_mobile ILIKE %s OR normalized_phone ILIKE %s
-            LIMIT 1
-        """, (received_normalize, received_normalize))
-
-        # Fetch the result
-        partner_id = request.env.cr.fetchone()
-        partner = None
-
-        if partner_id:
-            # If a partner is found, load the record
-            partner = request.env['res.partner'].sudo().browse(partner_id[0])
+        History = request.env['whatsapp.message.history']
+        History.check_access('read')
+        if format not in ('csv', 'jsonl'):
+            return request.make_json_response({'error': 'Unsupported format'}, status=400)
+        try:
+            columns, query, params = History._get_export_query(
+                date_from=date_from, date_to=date_to, config_id=config_id, status=status,
+                include_body=include_body not in ('0', 'false', 'False'),
+            )
+        except ValueError as e:
+            return request.make_json_response({'error': str(e)}, status=400)
+        dbname = request.env.cr.dbname
+        if format == 'csv':
+            stream = history_export.stream_csv(dbname, columns, query, params)
+            headers = [('Content-Type', 'text/csv; charset=utf-8'),
+                       ('Content-Disposition', 'attachment; filename="whatsapp_history.csv"')]
         else:
-            # If no partner is found, create a new one
-            contact = contacts[0] if contacts else {}
-            partner = request.env['res.partner'].sudo().create({
-                'name': contact.get('profile', {}).get('name', phone_number),
-                'phone': phone_number,
-                'mobile': phone_number,
-            })
-
-        return partner
\ No newline at end of file
+            stream = history_export.stream_jsonl_gzip(dbname, columns, query, params)
+            headers = [('Content-Type', 'application/gzip'),
+                       ('Content-Disposition', 'attachment; filename="whatsapp_history.jsonl.gz"')]
+        return http.Response(stream, headers=headers, direct_passthrough=True)
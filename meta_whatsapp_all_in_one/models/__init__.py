@@ -2,4 +2,10 @@ from . import configuration
 from . import message_template
 from . import message_configure
 from . import message_history
-from . import inherit
\ No newline at end of file
+from . import inherit
+from . import media_download
+from . import outbound_message
+from . import conversation_window
+from . import message_history_index
+from . import partner_import
+from . import partner_number
\ No newline at end of file
@@ -1,13 +1,24 @@
-from odoo import models, fields, api, _
-from odoo.exceptions import UserError
-import requests
+from odoo import models, fields, api, tools, _
+from odoo.exceptions import UserError, ValidationError
 import string
 import secrets
 import json
 import logging
+from collections import namedtuple
+from datetime import datetime, timezone
+from ..tools import get_breaker, get_tracker, graph_request
 
 _logger = logging.getLogger(__name__)
 
+# (connect, read) timeout of media uploads, which take longer than other Graph API calls
+MEDIA_UPLOAD_TIMEOUT = (5, 60)
+
+SNAPSHOT_FIELDS = (
+    'name', 'api_url', 'instance_id', 'business_account_id', 'access_token', 'app_id',
+    'webhook_token', 'app_secret', 'pair_rate_interval', 'media_download_concurrency',
+)
+ConfigSnapshot = namedtuple('ConfigSnapshot', ('id', 'write_date') + SNAPSHOT_FIELDS)
+
 
 class WhatsAppConfig(models.Model):
     _name = "whatsapp.config"
@@ -60,6 +71,7 @@ class WhatsAppConfig(models.Model):
         string="Webhook URL",
         readonly=True,
         compute="_compute_webhook_url",
+        store=True,
         help="Webhook URL for receiving WhatsApp messages"
     )
     webhook_token = fields.Char(
@@ -68,7 +80,60 @@ class WhatsAppConfig(models.Model):
         default=lambda self: self._generate_webhook_token(),
         help="Token for verifying Meta webhook requests"
     )
+    app_secret = fields.Char(
+        string="App Secret",
+        help="App Secret from Meta Developer Console, used to verify the X-Hub-Signature-256 of webhook requests"
+    )
+    pair_rate_interval = fields.Float(
+        string="Pair Rate Interval (s)",
+        default=1.0,
+        help="Minimum number of seconds between two consecutive messages to the same recipient"
+    )
+    rate_limit_state = fields.Selection(
+        [
+            ('ok', 'OK'),
+            ('slowed', 'Slowed Down'),
+            ('paused', 'Paused'),
+        ],
+        string="Rate Limit Status",
+        default='ok',
+        readonly=True,
+        help="Sending status derived from the Graph API usage headers and throttling errors"
+    )
+    rate_limit_usage = fields.Integer(
+        string="API Usage (%)",
+        readonly=True,
+        help="Highest usage percentage reported by X-App-Usage / X-Business-Use-Case-Usage"
+    )
+    rate_limit_paused_until = fields.Datetime(
+        string="Paused Until",
+        readonly=True,
+        help="Sending is paused until this time after Meta throttled the number"
+    )
+    rate_limit_last_error = fields.Char(string="Last Rate Limit Error", readonly=True)
+    rate_limit_reset_at = fields.Datetime(
+        string="Rate Limit Reset At",
+        readonly=True,
+        help="Last manual reset of the rate limit, applied by every worker on its next send"
+    )
+    circuit_state = fields.Selection(
+        [('closed', 'Reachable'), ('open', 'Unreachable')],
+        string="Graph API",
+        default='closed',
+        readonly=True,
+        help="Whether the Graph API is reachable. While unreachable, messages are spooled."
+    )
+    circuit_retry_at = fields.Datetime(
+        string="Next Health Check",
+        readonly=True,
+        help="When the Graph API is probed again after it became unreachable"
+    )
     template_ids = fields.One2many('whatsapp.template', 'config_id', string="Templates")
+    media_download_concurrency = fields.Integer(
+        string="Media Download Concurrency",
+        default=4,
+        help="Maximum number of inbound media files downloaded in parallel for this configuration"
+    )
 
     verified_name = fields.Char(string="Verified Name", readonly=True, help="Verified name of the phone number")
     code_verification_status = fields.Char(string="Code Verification Status", readonly=True,
@@ -87,13 +152,221 @@ class WhatsAppConfig(models.Model):
     business_email = fields.Char(string="Business Email", readonly=True, help="Contact email address of the business")
     business_websites = fields.Char(string="Business Websites", readonly=True, )
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        # configurations created before the app secret existed keep accepting unsigned webhooks, new ones may not
+        if any(not vals.get('app_secret') for vals in vals_list):
+            raise ValidationError(_("An App Secret is required to verify the signature of webhook requests."))
+        records = super(WhatsAppConfig, self).create(vals_list)
+        self.env.registry.clear_cache()
+        return records
+
+    def write(self, vals):
+        res = super(WhatsAppConfig, self).write(vals)
+        if {'operator_ids', *SNAPSHOT_FIELDS} & vals.keys():
+            self.env.registry.clear_cache()
+        return res
+
+    def unlink(self):
+        res = super(WhatsAppConfig, self).unlink()
+        self.env.registry.clear_cache()
+        return res
+
+    @api.model
+    @tools.ormcache('config_id')
+    def _get_snapshot(self, config_id):
+        """
+        Return an immutable ConfigSnapshot of the credentials and endpoints of
+        a configuration, or None when it does not exist. Cached per worker and
+        dropped in every worker (registry cache signaling) when one of these
+        fields is written, so the webhook and send paths skip the ORM.
+        """
+        config = self.sudo().browse(config_id).exists()
+        if not config:
+            return None
+        return ConfigSnapshot(config.id, config.write_date, *(config[name] for name in SNAPSHOT_FIELDS))
+
+    def _snapshot(self):
+        self.ensure_one()
+        return self._get_snapshot(self.id)
+
+    @api.model
+    def _get_webhook_app_secret(self, config_id):
+        """
+        Return the app secret of a configuration from its cached snapshot, so
+        webhook signatures can be checked without a database read. Returns
+        None when the configuration does not exist and '' when no secret is set.
+        """
+        snapshot = self._get_snapshot(config_id)
+        if snapshot is None:
+            return None
+        return snapshot.app_secret or ''
+
+    @api.model
+    @tools.ormcache()
+    def _get_webhook_routing(self):
+        """
+        Return ``{phone number id: (configuration id, app secret)}`` for all
+        configurations, cached per worker, to route the shared webhook. When
+        several configurations share a phone number id (only possible with
+        data predating _check_instance_id), the oldest one gets the traffic.
+        """
+        routing = {}
+        for config in self.sudo().search([], order='id'):
+            if config.instance_id in routing:
+                _logger.warning("WhatsApp configurations %s and %s share the phone number ID %s, "
+                                "the shared webhook routes it to %s only",
+                                routing[config.instance_id][0], config.id, config.instance_id,
+                                routing[config.instance_id][0])
+                continue
+            routing[config.instance_id] = (config.id, config.app_secret or '')
+        return routing
+
+    @api.constrains('instance_id')
+    def _check_instance_id(self):
+        """The shared webhook routes on the phone number id, which must therefore be unique."""
+        for config in self:
+            if self.search_count([('instance_id', '=', config.instance_id), ('id', '!=', config.id)]):
+                raise ValidationError(_("Another WhatsApp configuration already uses the Phone Number ID %s.",
+                                        config.instance_id))
+
+    def _rate_limit_tracker(self):
+        """Return the rate limit tracker of this configuration, aware of pauses stored by other workers."""
+        self.ensure_one()
+        tracker = get_tracker(self.id)
+        if self.rate_limit_reset_at:
+            reset_at = self.rate_limit_reset_at.replace(tzinfo=timezone.utc).timestamp()
+            if reset_at > tracker.reset_at:
+                tracker.reset(reset_at)
+        if self.rate_limit_paused_until:
+            tracker.pause_until(self.rate_limit_paused_until.replace(tzinfo=timezone.utc).timestamp())
+        return tracker
+
+    def _sync_rate_limit_state(self):
+        """Store the tracker state on the configuration, only when it changed noticeably."""
+        for config in self:
+            tracker = get_tracker(config.id)
+            snapshot = tracker.snapshot()
+            state_key = (snapshot['state'], snapshot['usage'] // 10, snapshot['paused_until'], snapshot['last_error'])
+            if state_key == tracker.synced_state:
+                continue
+            tracker.synced_state = state_key
+            paused_until = snapshot['paused_until']
+            config.sudo().write({
+                'rate_limit_state': snapshot['state'],
+                'rate_limit_usage': snapshot['usage'],
+                'rate_limit_paused_until': datetime.fromtimestamp(paused_until, timezone.utc).replace(tzinfo=None)
+                if paused_until else False,
+                'rate_limit_last_error': snapshot['last_error'],
+            })
+
+    def _circuit_breaker(self):
+        """Return the circuit breaker of this configuration, aware of openings stored by other workers."""
+        self.ensure_one()
+        breaker = get_breaker(self.id)
+        if self.circuit_state == 'open' and self.circuit_retry_at:
+            breaker.open_until(self.circuit_retry_at.replace(tzinfo=timezone.utc).timestamp())
+        return breaker
+
+    def _sync_circuit_state(self):
+        """Store the circuit breaker state on the configuration when it changed."""
+        for config in self:
+            breaker = config._circuit_breaker()
+            if breaker.state == 'closed':
+                vals = {'circuit_state': 'closed', 'circuit_retry_at': False}
+            else:
+                vals = {
+                    'circuit_state': 'open',
+                    'circuit_retry_at': datetime.fromtimestamp(breaker.retry_at, timezone.utc).replace(
+                        tzinfo=None, microsecond=0),
+                }
+            if config.circuit_state == vals['circuit_state'] and config.circuit_retry_at == vals['circuit_retry_at']:
+                continue
+            config.sudo().write(vals)
+            if vals['circuit_retry_at']:
+                breaker.open_until(breaker.retry_at)
+
+    def _check_graph_api_health(self):
+        """
+        Probe the Graph API with a light request on the phone number. Any
+        answer but a 5xx closes the circuit breaker of the configuration.
+        Returns whether the circuit is closed afterwards.
+        """
+        self.ensure_one()
+        config = self._snapshot()
+        try:
+            graph_request('GET', f"{config.api_url}/{config.instance_id}", operation='health_check',
+                          config_id=config.id, headers={'Authorization': f'Bearer {config.access_token}'},
+                          params={'fields': 'id'}, timeout=10)
+        except Exception as e:
+            _logger.info("Graph API still unreachable for config ID %s: %s", config.id, str(e))
+        return get_breaker(config.id).state == 'closed'
+
+    def _upload_media(self, filename, file_data, media_type, mime_type):
+        """
+        Upload a media file to the phone number of the configuration and return
+        its WhatsApp media id. Errors meaning the Graph API is unreachable are
+        raised as is, for the caller to spool the message.
+        """
+        self.ensure_one()
+        config = self._snapshot()
+        files = {
+            'file': (filename, file_data, mime_type),
+            'messaging_product': (None, 'whatsapp'),
+            'type': (None, media_type),
+        }
+        response = graph_request('POST', f"{config.api_url}/{config.instance_id}/media", operation='media_upload',
+                                 config_id=config.id, headers={'Authorization': f'Bearer {config.access_token}'},
+                                 files=files, timeout=MEDIA_UPLOAD_TIMEOUT)
+        if response.status_code != 200:
+            _logger.error("Failed to upload media: %s", response.text)
+            raise UserError(_('Failed to upload media: %s') % response.text)
+        media_id = response.json().get('id')
+        if not media_id:
+            raise UserError(_('Media ID not found in response.'))
+        return media_id
+
+    def action_reset_rate_limit(self):
+        """
+        Lift a rate limit pause manually. The stored reset time makes the other
+        workers drop their in-memory pause too, on their next send.
+        """
+        now = fields.Datetime.now()
+        for config in self:
+            get_tracker(config.id).reset(now.replace(tzinfo=timezone.utc).timestamp())
+        self.write({
+            'rate_limit_state': 'ok',
+            'rate_limit_usage': 0,
+            'rate_limit_paused_until': False,
+            'rate_limit_last_error': False,
+            'rate_limit_reset_at': now,
+        })
+
+    def _handle_inbound_messages(self, inbound):
+        """
+        Hook called once per webhook change with the inbound messages it
+        created, after the history, chat and conversation window updates.
+        ``inbound`` is a list of dicts with the raw ``message``, its ``type``,
+        ``partner`` and ``history`` record. Does nothing by default.
+        """
+        self.ensure_one()
+
     @api.depends('name')
     def _compute_webhook_url(self):
-        """Compute the webhook URL based on Odoo's base URL and provider ID."""
+        """
+        Compute the webhook URL based on Odoo's base URL and provider ID. Stored,
+        and recomputed for all configurations when web.base.url changes.
+        """
         base_url = self.env['ir.config_parameter'].sudo().get_param('web.base.url')
         for record in self:
             record.webhook_url = f"{base_url}/whatsapp/webhook/{record.id}"
 
+    @api.model
+    def _refresh_webhook_urls(self):
+        """Recompute the stored webhook URL of every configuration, after web.base.url changed."""
+        configs = self.sudo().with_context(active_test=False).search([])
+        self.env.add_to_compute(self._fields['webhook_url'], configs)
+
     def _generate_webhook_token(self):
         """Generate a secure webhook token for Meta verification."""
         characters = string.ascii_letters + string.digits + string.punctuation
@@ -123,7 +396,7 @@ class WhatsAppConfig(models.Model):
                 'Authorization': f'Bearer {self.access_token}',
                 'Content-Type': 'application/json',
             }
-            response = requests.get(url, headers=headers)
+            response = graph_request('GET', url, operation='business_profile', headers=headers)
             if response.status_code == 200:
                 data = response.json()
                 profile_data = data.get('data', [{}])[0]
@@ -167,7 +440,7 @@ class WhatsAppConfig(models.Model):
                 'Authorization': f'Bearer {self.access_token}',
                 'Content-Type': 'application/json',
             }
-            response = requests.get(url, headers=headers)
+            response = graph_request('GET', url, operation='verify_configuration', headers=headers)
             if response.status_code == 200:
                 self.write({'state': 'verified'})
                 return {
@@ -205,7 +478,7 @@ class WhatsAppConfig(models.Model):
                 'Authorization': f'Bearer {self.access_token}',
                 'Content-Type': 'application/json',
             }
-            response = requests.get(url, headers=headers)
+            response = graph_request('GET', url, operation='message_templates', headers=headers)
             if response.status_code != 200:
                 _logger.error("Failed to fetch templates: %s", response.text)
                 raise UserError(_('Failed to fetch templates: %s') % response.text)
@@ -323,7 +596,7 @@ class WhatsAppConfig(models.Model):
                 'Authorization': f'Bearer {self.access_token}',
                 'Content-Type': 'application/json',
             }
-            response = requests.get(url, headers=headers)
+            response = graph_request('GET', url, operation='phone_number', headers=headers)
             if response.status_code != 200:
                 _logger.error("Failed to fetch phone number details: %s", response.text)
                 raise UserError(_('Failed to fetch phone number details: %s') % response.text)
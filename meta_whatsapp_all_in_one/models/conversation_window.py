@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+from datetime import timedelta
+
+from odoo import models, fields, api, _
+
+CONVERSATION_WINDOW = timedelta(hours=24)
+
+
+class WhatsAppConversationWindow(models.Model):
+    """
+    Last inbound message time per (configuration, partner). Meta only accepts
+    freeform messages within 24 hours of the customer's last message, so the
+    senders check this index before choosing between a template and text.
+    """
+    _name = 'whatsapp.conversation.window'
+    _description = 'WhatsApp Conversation Window'
+    _rec_name = 'partner_id'
+
+    config_id = fields.Many2one('whatsapp.config', string="Configuration", required=True, ondelete='cascade')
+    partner_id = fields.Many2one('res.partner', string="Partner", required=True, ondelete='cascade')
+    last_inbound_at = fields.Datetime(string="Last Inbound Message", required=True)
+
+    _sql_constraints = [
+        ('config_partner_uniq', 'UNIQUE(config_id, partner_id)', 'Only one conversation window per partner and configuration.'),
+    ]
+
+    def init(self):
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS whatsapp_conversation_window_config_last_inbound_idx
+                ON whatsapp_conversation_window (config_id, last_inbound_at)
+        """)
+        # Seed the index from the inbound messages already in the history
+        self.env.cr.execute("""
+            INSERT INTO whatsapp_conversation_window
+                   (config_id, partner_id, last_inbound_at, create_date, write_date)
+            SELECT config_id, partner_id, MAX(received_date), (now() AT TIME ZONE 'UTC'), (now() AT TIME ZONE 'UTC')
+              FROM whatsapp_message_history
+             WHERE status = 'received' AND partner_id IS NOT NULL AND received_date IS NOT NULL
+          GROUP BY config_id, partner_id
+            ON CONFLICT (config_id, partner_id) DO NOTHING
+        """)
+
+    @api.model
+    def _touch(self, config_id, inbound_times):
+        """
+        Record inbound messages: ``inbound_times`` maps partner ids to the time
+        of their latest message. Upserted in a single statement.
+        """
+        if not inbound_times:
+            return
+        values = []
+        params = []
+        for partner_id, inbound_at in inbound_times.items():
+            values.append("(%s, %s, %s, %s, %s, (now() AT TIME ZONE 'UTC'), (now() AT TIME ZONE 'UTC'))")
+            params += [config_id, partner_id, inbound_at, self.env.uid, self.env.uid]
+        self.env.cr.execute(f"""
+            INSERT INTO whatsapp_conversation_window
+                   (config_id, partner_id, last_inbound_at, create_uid, write_uid, create_date, write_date)
+            VALUES {', '.join(values)}
+            ON CONFLICT (config_id, partner_id) DO UPDATE
+               SET last_inbound_at = GREATEST(whatsapp_conversation_window.last_inbound_at, EXCLUDED.last_inbound_at),
+                   write_date = EXCLUDED.write_date
+        """, params)
+        self.invalidate_model(['last_inbound_at'])
+
+    @api.model
+    def _is_open(self, config_id, partner_id):
+        """Return whether the partner can receive freeform messages on the configuration."""
+        self.env.cr.execute("""
+            SELECT 1
+              FROM whatsapp_conversation_window
+             WHERE config_id = %s
+               AND partner_id = %s
+               AND last_inbound_at >= %s
+        """, (config_id, partner_id, fields.Datetime.now() - CONVERSATION_WINDOW))
+        return bool(self.env.cr.fetchone())
@@ -4,15 +4,19 @@ import base64
 import secrets
 import lxml.etree as ET
 from markupsafe import escape
-from odoo import models, fields, api, _
+from odoo import models, fields, api, tools, _
 from odoo.exceptions import ValidationError
-import phonenumbers
+from ..tools.partner_import import IMPORT_FIELDS, normalize_rows
+from ..tools.phone import normalize_phone_number
 
 class ResPartner(models.Model):
     _inherit = "res.partner"
 
-    normalized_phone = fields.Char(string="Normalized Phone", compute="_compute_normalized_phone", store=True)
-    normalized_mobile = fields.Char(string="Normalized Mobile", compute="_compute_normalized_mobile", store=True)
+    # readonly=False so that values given to create() (pre-normalized in bulk) are kept, not recomputed
+    normalized_phone = fields.Char(string="Normalized Phone", compute="_compute_normalized_phone", store=True,
+                                   index=True, precompute=True, readonly=False)
+    normalized_mobile = fields.Char(string="Normalized Mobile", compute="_compute_normalized_mobile", store=True,
+                                    index=True, precompute=True, readonly=False)
 
     @api.depends("phone")
     def _compute_normalized_phone(self):
@@ -28,19 +32,124 @@ class ResPartner(models.Model):
         """
         Normalize a phone number to E.164 format.
         """
-        try:
-            number = ''.join(char for char in str(number) if char.isdigit() or char == '+')
-            if str(number).startswith('00'):
-                number = str(number)[2:]
-            if str(number).startswith('0'):
-                number = str(number).lstrip('0')
-            if str(number).startswith('+'):
-                number = str(number).lstrip('+')
-            normalized = ''.join(filter(str.isdigit, number))
-            parsed_number = phonenumbers.parse(normalized)
-            return phonenumbers.format_number(parsed_number, phonenumbers.PhoneNumberFormat.E164)
-        except phonenumbers.NumberParseException:
-             return number
+        return normalize_phone_number(number)
+
+    @api.model
+    def _whatsapp_find_or_create(self, numbers, names=None):
+        """
+        Return a dict mapping each of ``numbers`` to its partner, creating the
+        unknown ones in a single create() named after ``names`` (number -> name).
+        New numbers are first claimed in whatsapp.partner.number, whose unique
+        key makes a concurrent webhook creating the same contact fail with a
+        serialization error instead of creating a duplicate. The webhook
+        handlers let that error through, so Odoo retries the whole request
+        (odoo.service.model.retrying) and the retry finds the partner.
+        """
+        names = names or {}
+        keys = {number: normalize_phone_number(number) for number in set(numbers) if number}
+        if not keys:
+            return {}
+        found = self._whatsapp_search_normalized(set(keys.values()))
+        missing = {key for key in keys.values() if key not in found}
+        if missing:
+            PartnerNumber = self.env['whatsapp.partner.number'].sudo()
+            claimed, known = PartnerNumber._claim(missing)
+            found.update(known)
+            vals_by_key = {}
+            for number, key in keys.items():
+                if key in claimed and key not in vals_by_key:
+                    vals_by_key[key] = {
+                        'name': names.get(number) or number,
+                        'phone': number,
+                        'mobile': number,
+                        'normalized_phone': key,
+                        'normalized_mobile': key,
+                    }
+            if vals_by_key:
+                partners = self.sudo().create(list(vals_by_key.values()))
+                created = dict(zip(vals_by_key, partners.ids))
+                PartnerNumber._assign(created)
+                found.update(created)
+        return {number: self.sudo().browse(found[key]) for number, key in keys.items() if key in found}
+
+    @api.model
+    def _whatsapp_search_normalized(self, keys):
+        """Map normalized numbers to the id of the first partner having it as mobile or phone."""
+        if not keys:
+            return {}
+        self.env.cr.execute("""
+            SELECT normalized_mobile, normalized_phone, MIN(id)
+              FROM res_partner
+             WHERE normalized_mobile = ANY(%(keys)s) OR normalized_phone = ANY(%(keys)s)
+          GROUP BY normalized_mobile, normalized_phone
+        """, {'keys': list(keys)})
+        found = {}
+        for normalized_mobile, normalized_phone, partner_id in self.env.cr.fetchall():
+            for key in (normalized_mobile, normalized_phone):
+                if key in keys:
+                    found[key] = min(found.get(key, partner_id), partner_id)
+        return found
+
+    def _whatsapp_import_partners(self, batches, pool=None):
+        """
+        Upsert contacts from ``batches`` (iterables of dicts with name, phone,
+        mobile and email). Numbers are normalized up front (in ``pool`` when
+        given), matched against existing partners on the normalized keys with
+        one query per batch, and new partners are created in one create() with
+        their normalized values precomputed. Existing partners are updated with
+        one write() per distinct set of values. Returns (created, updated) counts.
+        """
+        created = updated = 0
+        for rows in batches:
+            rows = normalize_rows(rows, pool)
+            keys = {key for row in rows for key in (row['normalized_phone'], row['normalized_mobile']) if key}
+            existing = {}
+            if keys:
+                self.env.cr.execute("""
+                    SELECT id, normalized_phone, normalized_mobile
+                      FROM res_partner
+                     WHERE normalized_phone = ANY(%(keys)s) OR normalized_mobile = ANY(%(keys)s)
+                  ORDER BY id
+                """, {'keys': list(keys)})
+                # rows come in id order, so a number shared by several partners maps to the oldest
+                for partner_id, normalized_phone, normalized_mobile in self.env.cr.fetchall():
+                    for key in (normalized_phone, normalized_mobile):
+                        if key:
+                            existing.setdefault(key, partner_id)
+
+            to_create = {}
+            to_update = {}
+            for row in rows:
+                key = row['normalized_mobile'] or row['normalized_phone']
+                if not key:
+                    continue
+                vals = {field: row[field] for field in IMPORT_FIELDS if row.get(field)}
+                partner_id = existing.get(row['normalized_mobile']) or existing.get(row['normalized_phone'])
+                if partner_id:
+                    vals.pop('phone', None)
+                    vals.pop('mobile', None)
+                    if vals:
+                        to_update[partner_id] = vals
+                else:
+                    vals.setdefault('name', row['mobile'] or row['phone'])
+                    vals['normalized_phone'] = row['normalized_phone']
+                    vals['normalized_mobile'] = row['normalized_mobile']
+                    # the last row wins when the file repeats a number
+                    to_create[key] = vals
+
+            if to_create:
+                self.sudo().create(list(to_create.values()))
+                created += len(to_create)
+            # partners getting the same values are updated in one write()
+            ids_by_vals = {}
+            for partner_id, vals in to_update.items():
+                ids_by_vals.setdefault(tuple(sorted(vals.items())), []).append(partner_id)
+            for vals, partner_ids in ids_by_vals.items():
+                self.sudo().browse(partner_ids).write(dict(vals))
+            updated += len(to_update)
+            self.env.flush_all()
+            self.env.invalidate_all()
+        return created, updated
 
 class ResUsers(models.Model):
     _inherit = 'res.users'
@@ -56,6 +165,52 @@ class ResUsers(models.Model):
         domain="[('id', 'in', allowed_providers)]",
         help="Default WhatsApp configuration used for sending messages."
     )
+
+    def write(self, vals):
+        res = super(ResUsers, self).write(vals)
+        if 'allowed_providers' in vals or 'default_provider' in vals:
+            self.env.registry.clear_cache()
+        return res
+
+    @api.model
+    @tools.ormcache('self.env.uid')
+    def _get_whatsapp_snapshot(self):
+        """
+        Return the WhatsApp permissions of the current user as plain ids.
+        Cached per user and cleared whenever providers or operators change.
+        """
+        user = self.env.user
+        operator_configs = self.env['whatsapp.config'].sudo().search([('operator_ids', 'in', user.id)])
+        return {
+            'allowed_config_ids': tuple(user.allowed_providers.ids),
+            'default_provider_id': user.default_provider.id,
+            'operator_config_ids': tuple(operator_configs.ids),
+        }
+class IrConfigParameter(models.Model):
+    _inherit = 'ir.config_parameter'
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super(IrConfigParameter, self).create(vals_list)
+        if any(vals.get('key') == 'web.base.url' for vals in vals_list):
+            self.env['whatsapp.config']._refresh_webhook_urls()
+        return records
+
+    def write(self, vals):
+        base_url_changed = any(param.key == 'web.base.url' for param in self)
+        res = super(IrConfigParameter, self).write(vals)
+        if base_url_changed or vals.get('key') == 'web.base.url':
+            self.env['whatsapp.config']._refresh_webhook_urls()
+        return res
+
+    def unlink(self):
+        base_url_changed = any(param.key == 'web.base.url' for param in self)
+        res = super(IrConfigParameter, self).unlink()
+        if base_url_changed:
+            self.env['whatsapp.config']._refresh_webhook_urls()
+        return res
+
+
 class MailMessage(models.Model):
     _inherit = 'mail.message'
 
@@ -64,4 +219,21 @@ class MailMessage(models.Model):
 class DiscussChannel(models.Model):
     _inherit = 'discuss.channel'
 
-    whatsapp_config_id = fields.Many2one('whatsapp.config',string="WhatsApp Message ID")
\ No newline at end of file
+    whatsapp_config_id = fields.Many2one('whatsapp.config',string="WhatsApp Message ID")
+
+    def _whatsapp_queue_notification(self, notification_type, payload):
+        """
+        Queue a bus notification for this channel. All notifications queued in
+        the same transaction are pushed with a single _sendmany before commit.
+        """
+        self.ensure_one()
+        precommit = self.env.cr.precommit
+        pending = precommit.data.setdefault('whatsapp.bus_notifications', [])
+        if not pending:
+            precommit.add(self._whatsapp_flush_notifications)
+        pending.append((self, notification_type, payload))
+
+    def _whatsapp_flush_notifications(self):
+        pending = self.env.cr.precommit.data.pop('whatsapp.bus_notifications', [])
+        if pending:
+            self.env['bus.bus'].sudo()._sendmany(pending)
\ No newline at end of file
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import logging
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from odoo import models, fields, api, _
+from ..tools import graph_request
+
+_logger = logging.getLogger(__name__)
+
+MEDIA_MESSAGE_TYPES = ('image', 'document', 'audio', 'video', 'sticker')
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+DOWNLOAD_TIMEOUT = 30
+
+
+def _stream_media_to_file(api_url, access_token, media_id, directory):
+    """
+    Resolve a media id through the Graph API and stream its content into a
+    temporary file of ``directory``. Runs in a worker thread: no ORM access.
+    Returns a dict with the file path, its sha1/sha256 digests, size and mimetype.
+    """
+    headers = {'Authorization': f'Bearer {access_token}'}
+    response = graph_request('GET', f"{api_url}/{media_id}", operation='media_lookup', headers=headers,
+                             timeout=DOWNLOAD_TIMEOUT)
+    response.raise_for_status()
+    media = response.json()
+
+    sha1 = hashlib.sha1()
+    sha256 = hashlib.sha256()
+    size = 0
+    fd, path = tempfile.mkstemp(prefix='whatsapp-media-', dir=directory)
+    try:
+        with requests.get(media['url'], headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT) as download, \
+                os.fdopen(fd, 'wb') as tmp:
+            download.raise_for_status()
+            for chunk in download.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                tmp.write(chunk)
+                sha1.update(chunk)
+                sha256.update(chunk)
+                size += len(chunk)
+    except Exception:
+        os.unlink(path)
+        raise
+    return {
+        'path': path,
+        'sha1': sha1.hexdigest(),
+        'sha256': sha256.hexdigest(),
+        'size': size,
+        'mimetype': media.get('mime_type'),
+    }
+
+
+class WhatsAppMediaDownload(models.Model):
+    _name = 'whatsapp.media.download'
+    _description = 'WhatsApp Inbound Media Download'
+    _order = 'id'
+
+    config_id = fields.Many2one('whatsapp.config', string="Configuration", required=True, ondelete='cascade')
+    media_id = fields.Char(string="Media ID", required=True, help="Graph API media id received in the webhook")
+    media_type = fields.Char(string="Media Type")
+    mimetype = fields.Char(string="Mime Type")
+    filename = fields.Char(string="Filename")
+    sha256 = fields.Char(string="SHA-256", index=True, help="SHA-256 of the media content, used for deduplication")
+    history_id = fields.Many2one('whatsapp.message.history', string="History", ondelete='cascade')
+    mail_message_id = fields.Many2one('mail.message', string="Chat Message", ondelete='cascade')
+    attachment_id = fields.Many2one('ir.attachment', string="Attachment", ondelete='set null')
+    state = fields.Selection(
+        [('pending', 'Pending'), ('done', 'Done'), ('failed', 'Failed')],
+        string="Status",
+        default='pending',
+        index=True,
+    )
+    attempts = fields.Integer(string="Attempts", default=0)
+    error = fields.Char(string="Error")
+
+    @api.model
+    def _enqueue(self, config, message_type, media, history=False, mail_message=False):
+        """Queue the download of an inbound media and wake up the download cron."""
+        download = self.create({
+            'config_id': config.id,
+            'media_id': media.get('id'),
+            'media_type': message_type,
+            'mimetype': media.get('mime_type'),
+            'filename': media.get('filename') or f"{message_type}-{media.get('id')}",
+            'sha256': media.get('sha256'),
+            'history_id': history.id if history else False,
+            'mail_message_id': mail_message.id if mail_message else False,
+        })
+        precommit_data = self.env.cr.precommit.data
+        if not precommit_data.get('whatsapp.media_cron_triggered'):
+            precommit_data['whatsapp.media_cron_triggered'] = True
+            self.env.ref('meta_whatsapp_all_in_one.ir_cron_whatsapp_media_download')._trigger()
+        return download
+
+    @api.model
+    def _cron_process_downloads(self, batch_size=100):
+        """Download pending media, with a bounded thread pool per configuration."""
+        pending = self.search([('state', '=', 'pending')], limit=batch_size)
+        if not pending:
+            return
+        filestore = self.env['ir.attachment']._filestore()
+        os.makedirs(filestore, exist_ok=True)
+        for config, downloads in pending.grouped('config_id').items():
+            downloads._reuse_known_media()
+            downloads = downloads.filtered(lambda d: d.state == 'pending')
+            if not downloads:
+                continue
+            jobs = [(download, download.media_id) for download in downloads]
+            snapshot = config._snapshot()
+            with ThreadPoolExecutor(max_workers=max(snapshot.media_download_concurrency, 1)) as executor:
+                futures = [
+                    (download, executor.submit(_stream_media_to_file, snapshot.api_url, snapshot.access_token,
+                                               media_id, filestore))
+                    for download, media_id in jobs
+                ]
+                for download, future in futures:
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        _logger.error("Error downloading WhatsApp media %s: %s", download.media_id, str(e))
+                        download.write({
+                            'attempts': download.attempts + 1,
+                            'error': str(e)[:255],
+                            'state': 'failed' if download.attempts + 1 >= 3 else 'pending',
+                        })
+                        continue
+                    download._store_downloaded_file(result)
+            self.env.cr.commit()
+
+    def _reuse_known_media(self):
+        """Attach already downloaded content with the same SHA-256 without fetching it again."""
+        known = self.search([
+            ('sha256', 'in', [sha for sha in self.mapped('sha256') if sha]),
+            ('state', '=', 'done'),
+            ('attachment_id', '!=', False),
+        ])
+        attachments_by_sha = {download.sha256: download.attachment_id for download in known}
+        for download in self:
+            attachment = attachments_by_sha.get(download.sha256)
+            if attachment:
+                download._attach(attachment.copy({'name': download.filename}))
+
+    def _store_downloaded_file(self, result):
+        """Move a streamed temporary file into the filestore and link it as an attachment."""
+        self.ensure_one()
+        Attachment = self.env['ir.attachment'].sudo()
+        existing = self.search([('sha256', '=', result['sha256']), ('state', '=', 'done'),
+                                ('attachment_id', '!=', False)], limit=1)
+        if existing:
+            os.unlink(result['path'])
+            attachment = existing.attachment_id.copy({'name': self.filename})
+        elif Attachment._storage() == 'file':
+            fname = result['sha1'][:2] + '/' + result['sha1']
+            full_path = Attachment._full_path(fname)
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            if os.path.isfile(full_path):
+                os.unlink(result['path'])
+            else:
+                os.replace(result['path'], full_path)
+            attachment = Attachment.create({
+                'name': self.filename,
+                'store_fname': fname,
+                'checksum': result['sha1'],
+                'file_size': result['size'],
+                'mimetype': result['mimetype'] or self.mimetype,
+            })
+        else:
+            with open(result['path'], 'rb') as media_file:
+                attachment = Attachment.create({
+                    'name': self.filename,
+                    'raw': media_file.read(),
+                    'mimetype': result['mimetype'] or self.mimetype,
+                })
+            os.unlink(result['path'])
+        self.sha256 = result['sha256']
+        self._attach(attachment)
+
+    def _attach(self, attachment):
+        self.ensure_one()
+        self.write({'attachment_id': attachment.id, 'state': 'done', 'error': False})
+        message = self.mail_message_id
+        if message:
+            attachment.write({'res_model': 'discuss.channel', 'res_id': message.res_id})
+            message.sudo().write({'attachment_ids': [(4, attachment.id)]})
+            channel = self.env['discuss.channel'].sudo().browse(message.res_id)
+            channel._whatsapp_queue_notification(
+                'discuss.channel/transient_message', {
+                    'body': message.body,
+                    'author_id': message.author_id.id,
+                    'channel_id': channel.id,
+                }
+            )
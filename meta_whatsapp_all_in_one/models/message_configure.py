@@ -1,12 +1,28 @@
 # -*- coding: utf-8 -*-
 import base64
+import time
+from datetime import timedelta
 from odoo.exceptions import UserError
-import requests
 from odoo import models, fields, api, _
 import logging
+from ..tools import LazyLog, PAIR_RATE_ERROR_CODE, UNREACHABLE_ERRORS, PairRateDeferred, RateLimitPaused, error_code, \
+    graph_request, instrumented, log_sampled, maybe_sent, pair_scheduler, payload_digest
 
 _logger = logging.getLogger(__name__)
 
+CAPTION_MEDIA_TYPES = ('image', 'video', 'document')
+# Errors of a send that can't happen now, but later: the payload is spooled to the outbound queue
+SPOOLED_ERRORS = UNREACHABLE_ERRORS + (RateLimitPaused, PairRateDeferred)
+
+
+def _spool_delay(error):
+    """Seconds a payload spooled because of ``error`` waits, 0 meaning until the Graph API is reachable."""
+    if isinstance(error, PairRateDeferred):
+        return error.delay
+    if isinstance(error, RateLimitPaused):
+        return max(error.until - time.time(), 1)
+    return 0
+
 
 class MessageConfiguration(models.TransientModel):
     _name = 'message.configuration'
@@ -58,8 +74,10 @@ class MessageConfiguration(models.TransientModel):
 
     @api.depends('config_id')
     def _compute_allowed_config_ids(self):
+        snapshot = self.env['res.users']._get_whatsapp_snapshot()
+        allowed_configs = self.env['whatsapp.config'].browse(snapshot['allowed_config_ids'])
         for record in self:
-            record.allowed_config_ids = record.env.user.allowed_providers
+            record.allowed_config_ids = allowed_configs
 
     @api.model
     def default_get(self, fields_list):
@@ -67,10 +85,11 @@ class MessageConfiguration(models.TransientModel):
         active_model = self.env.context.get('active_model')
         active_id = self.env.context.get('active_id')
 
+        snapshot = self.env['res.users']._get_whatsapp_snapshot()
         if 'config_id' in fields_list and not res.get('config_id'):
-            default_provider = self.env.user.default_provider
-            if default_provider and default_provider in self.env.user.allowed_providers:
-                res['config_id'] = default_provider.id
+            default_provider_id = snapshot['default_provider_id']
+            if default_provider_id and default_provider_id in snapshot['allowed_config_ids']:
+                res['config_id'] = default_provider_id
 
         if 'recipient' in fields_list and active_model and active_id and not res.get('recipient'):
             if active_model == 'res.partner':
@@ -81,9 +100,9 @@ class MessageConfiguration(models.TransientModel):
                     res['recipient'] = order.partner_id.id
 
         if 'model' in fields_list and active_model and not res.get('model'):
-            model = self.env['ir.model'].search([('model', '=', active_model)], limit=1)
-            if model:
-                res['model'] = model.id
+            model_id = self.env['ir.model']._get_id(active_model)
+            if model_id:
+                res['model'] = model_id
 
         return res
 
@@ -93,7 +112,7 @@ class MessageConfiguration(models.TransientModel):
         return {
             'domain': {
                 'template_id': [('config_id', '=', self.config_id.id), ('status', '=', 'APPROVED')],
-                'config_id': [('id', 'in', self.env.user.allowed_providers.ids)]
+                'config_id': [('id', 'in', list(self.env['res.users']._get_whatsapp_snapshot()['allowed_config_ids']))]
             }
         }
 
@@ -104,58 +123,47 @@ class MessageConfiguration(models.TransientModel):
         else:
             self.message = False
 
+    def _get_media_type(self):
+        """Return the WhatsApp media type and the mime type of the attachment, from its file name."""
+        filename = self.attachment_filename.lower()
+        if filename.endswith(('.jpg', '.jpeg', '.png')):
+            return 'image', 'image/jpeg' if filename.endswith(('.jpg', '.jpeg')) else 'image/png'
+        if filename.endswith('.pdf'):
+            return 'document', 'application/pdf'
+        if filename.endswith(('.mp4', '.3gp')):
+            return 'video', 'video/mp4'
+        if filename.endswith(('.mp3', '.amr')):
+            return 'audio', 'audio/mp3'
+        raise UserError(
+            _('Unsupported file type. Supported types: image (jpg, png), document (pdf), video (mp4, 3gp), audio (mp3, amr).'))
+
     def _upload_media(self):
-        """Upload media attachment to WhatsApp API and return media_id, media_type, file_data, filename."""
+        """
+        Upload media attachment to WhatsApp API and return media_id, media_type, file_data, filename.
+        SPOOLED_ERRORS (unreachable Graph API, rate limit pause) are raised as is, for the message to be spooled.
+        """
         if not self.attachment:
             return None, None, None, None
 
         try:
             file_data = base64.b64decode(self.attachment)
-            filename = self.attachment_filename.lower()
-            if filename.endswith(('.jpg', '.jpeg', '.png')):
-                media_type = 'image'
-                mime_type = 'image/jpeg' if filename.endswith(('.jpg', '.jpeg')) else 'image/png'
-            elif filename.endswith('.pdf'):
-                media_type = 'document'
-                mime_type = 'application/pdf'
-            elif filename.endswith(('.mp4', '.3gp')):
-                media_type = 'video'
-                mime_type = 'video/mp4'
-            elif filename.endswith(('.mp3', '.amr')):
-                media_type = 'audio'
-                mime_type = 'audio/mp3'
-            else:
-                raise UserError(
-                    _('Unsupported file type. Supported types: image (jpg, png), document (pdf), video (mp4, 3gp), audio (mp3, amr).'))
-
-            url = f"{self.config_id.api_url}/{self.config_id.instance_id}/media"
-            headers = {
-                'Authorization': f'Bearer {self.config_id.access_token}',
-            }
-            files = {
-                'file': (self.attachment_filename, file_data, mime_type),
-                'messaging_product': (None, 'whatsapp'),
-                'type': (None, media_type),
-            }
-            response = requests.post(url, headers=headers, files=files)
-            if response.status_code != 200:
-                _logger.error("Failed to upload media: %s", response.text)
-                raise UserError(_('Failed to upload media: %s') % response.text)
-
-            media_id = response.json().get('id')
-            if not media_id:
-                raise UserError(_('Media ID not found in response.'))
-
+            media_type, mime_type = self._get_media_type()
+            media_id = self.config_id._upload_media(self.attachment_filename, file_data, media_type, mime_type)
             return media_id, media_type, file_data, self.attachment_filename
 
+        except SPOOLED_ERRORS:
+            raise
         except Exception as e:
             _logger.error("Error uploading media: %s", str(e))
             raise UserError(_('Error uploading media: %s') % str(e))
 
+    @instrumented('send.action_send_message')
     def action_send_message(self):
         self.ensure_one()
         at_least_one_success = False
         any_attempt_made = False
+        # (payload, error) that can't be sent now (SPOOLED_ERRORS), spooled to the outbound queue
+        spooled = []
 
         number = self.recipient.phone if self.number == 'phone' else self.recipient.mobile
         if number and number.startswith('+'):
@@ -187,28 +195,55 @@ class MessageConfiguration(models.TransientModel):
                 }
             }
 
-        if self.config_id not in self.env.user.allowed_providers:
+        if self.config_id.id not in self.env['res.users']._get_whatsapp_snapshot()['allowed_config_ids']:
             raise UserError(_("Selected configuration is not allowed for this user."))
 
+        # Freeform text and media are only accepted within 24h of the customer's last message
+        window_open = self.env['whatsapp.conversation.window'].sudo()._is_open(self.config_id.id, self.recipient.id)
+        if not window_open and not self.template_id:
+            return {
+                'type': 'ir.actions.client',
+                'tag': 'display_notification',
+                'params': {
+                    'title': _('Warning'),
+                    'message': _('%s has not written to you in the last 24 hours. '
+                                 'Select an approved template to start the conversation.') % self.recipient.name,
+                    'type': 'warning',
+                    'sticky': False,
+                }
+            }
+        if not window_open and (self.message or self.attachment):
+            raise UserError(_("%s has not written to you in the last 24 hours: only the template can be sent. "
+                              "Remove the message and the attachment, or send them once %s replies.")
+                            % (self.recipient.name, self.recipient.name))
+
+        self.config_id._rate_limit_tracker()
+        self.config_id._circuit_breaker()
         media_id = None
         media_type = None
         file_data = None
         filename = None
-        if self.attachment:
+        # Set when the upload can't happen now: the attachment is spooled and uploaded by the dispatcher
+        upload_error = None
+        if self.attachment and window_open:
             try:
                 media_id, media_type, file_data, filename = self._upload_media()
+            except SPOOLED_ERRORS as e:
+                media_type = self._get_media_type()[0]
+                upload_error = e
             except Exception as e:
                 _logger.error("Error uploading media: %s", str(e))
                 media_id = None
 
+        config = self.config_id._snapshot()
         headers = {
-            'Authorization': f'Bearer {self.config_id.access_token}',
+            'Authorization': f'Bearer {config.access_token}',
             'Content-Type': 'application/json',
         }
-        url = f"{self.config_id.api_url}/{self.config_id.instance_id}/messages"
+        url = f"{config.api_url}/{config.instance_id}/messages"
 
         channel = self._get_or_create_chat_channel(self.recipient, self.config_id.id)
-        _logger.info('Created/found channel: %s (ID: %d)', channel.name, channel.id)
+        _logger.debug('Created/found channel: %s', channel.id)
 
         if self.template_id:
             any_attempt_made = True
@@ -225,8 +260,9 @@ class MessageConfiguration(models.TransientModel):
                 }
             }
             try:
-                response = requests.post(url, headers=headers, json=template_payload)
-                _logger.info('WhatsApp API response: %s', response.text)
+                response = self._post_message(url, headers, number, template_payload)
+                log_sampled(_logger, logging.INFO, self.env, 'WhatsApp API response: %s %s',
+                            response.status_code, LazyLog(payload_digest, response.content))
                 if response.status_code in [200, 201]:
                     at_least_one_success = True
                     response_data = response.json()
@@ -237,10 +273,15 @@ class MessageConfiguration(models.TransientModel):
                         'message_id': message_id,
                         'conversation_id': conversation_id,
                     })
+            except SPOOLED_ERRORS as e:
+                spooled.append((template_payload, e))
             except Exception as e:
                 _logger.error("Error sending template message: %s", str(e))
 
-        if self.message:
+        # Send the text as the media caption when possible: one message instead of two to the same user
+        caption_merged = bool(self.message and (media_id or upload_error) and media_type in CAPTION_MEDIA_TYPES)
+
+        if self.message and not caption_merged and window_open:
             any_attempt_made = True
             text_payload = {
                 "messaging_product": "whatsapp",
@@ -251,8 +292,9 @@ class MessageConfiguration(models.TransientModel):
                 }
             }
             try:
-                response = requests.post(url, headers=headers, json=text_payload)
-                _logger.info('WhatsApp API response: %s', response.text)
+                response = self._post_message(url, headers, number, text_payload)
+                log_sampled(_logger, logging.INFO, self.env, 'WhatsApp API response: %s %s',
+                            response.status_code, LazyLog(payload_digest, response.content))
                 if response.status_code in [200, 201]:
                     at_least_one_success = True
                     response_data = response.json()
@@ -274,10 +316,11 @@ class MessageConfiguration(models.TransientModel):
                             'whatsapp_message_id': message_id,
                         })
 
-                        _logger.info('Created mail.message for text: ID %d, body %s, channel %d', message.id,
-                                     self.message, channel.id)
-                        self.env['bus.bus']._sendone(
-                            channel, 'discuss.channel/transient_message', {
+                        log_sampled(_logger, logging.DEBUG, self.env,
+                                    'Created mail.message for text: ID %d, body %s, channel %d', message.id,
+                                    LazyLog(payload_digest, self.message), channel.id)
+                        channel._whatsapp_queue_notification(
+                            'discuss.channel/transient_message', {
                                 'body': self.message,
                                 'author_id': self.env.user.partner_id.id,
                                 'channel_id': channel.id,
@@ -285,9 +328,23 @@ class MessageConfiguration(models.TransientModel):
                         )
                 else:
                     _logger.error("WhatsApp API error: %s", response.text)
+            except SPOOLED_ERRORS as e:
+                spooled.append((text_payload, e))
             except Exception as e:
                 _logger.error("Error sending text message: %s", str(e))
 
+        if upload_error:
+            any_attempt_made = True
+            media_payload = {
+                "messaging_product": "whatsapp",
+                "to": number,
+                "type": media_type,
+                media_type: {}
+            }
+            if caption_merged:
+                media_payload[media_type]['caption'] = self.message
+            spooled.append((media_payload, upload_error))
+
         if media_id:
             any_attempt_made = True
             media_payload = {
@@ -298,9 +355,12 @@ class MessageConfiguration(models.TransientModel):
                     "id": media_id
                 }
             }
+            if caption_merged:
+                media_payload[media_type]['caption'] = self.message
             try:
-                response = requests.post(url, headers=headers, json=media_payload)
-                _logger.info('WhatsApp API response: %s', response.text)
+                response = self._post_message(url, headers, number, media_payload)
+                log_sampled(_logger, logging.INFO, self.env, 'WhatsApp API response: %s %s',
+                            response.status_code, LazyLog(payload_digest, response.content))
                 if response.status_code in [200, 201]:
                     at_least_one_success = True
                     response_data = response.json()
@@ -329,7 +389,7 @@ class MessageConfiguration(models.TransientModel):
                             'res_id': channel.id,
                             'message_type': 'comment',
                             'subtype_id': self.env.ref('mail.mt_comment').id,
-                            'body': '',
+                            'body': self.message if caption_merged else '',
                             'author_id': self.env.user.partner_id.id,
                             'date': fields.Datetime.now(),
                             'whatsapp_message_id': message_id,
@@ -339,6 +399,8 @@ class MessageConfiguration(models.TransientModel):
 
                 else:
                     _logger.error("WhatsApp API error: %s", response.text)
+            except SPOOLED_ERRORS as e:
+                spooled.append((media_payload, e))
             except Exception as e:
                 _logger.error("Error sending media message: %s", str(e))
 
@@ -357,11 +419,41 @@ class MessageConfiguration(models.TransientModel):
                 }
             }
 
+        self.config_id._sync_rate_limit_state()
+        self.config_id._sync_circuit_state()
+        spool_note = False
+        if spooled:
+            self._spool_payloads(number, spooled)
+            errors = [error for _payload, error in spooled]
+            wait = max(_spool_delay(error) for error in errors)
+            if any(isinstance(error, UNREACHABLE_ERRORS) for error in errors):
+                spool_note = _('WhatsApp is unreachable right now. The message to %s is queued '
+                               'and will be sent as soon as it is back.') % self.recipient.name
+            elif any(isinstance(error, RateLimitPaused) for error in errors):
+                spool_note = _('WhatsApp is rate limiting this number. The message to %s is queued '
+                               'and will be sent in %d seconds.') % (self.recipient.name, wait)
+            else:
+                spool_note = _('Too many messages were sent to %s in a row. The message is queued '
+                               'and will be sent in %d seconds.') % (self.recipient.name, wait)
+            if not at_least_one_success:
+                return {
+                    'type': 'ir.actions.client',
+                    'tag': 'display_notification',
+                    'params': {
+                        'title': _('Queued'),
+                        'message': spool_note,
+                        'type': 'info',
+                        'sticky': False,
+                        'next': {'type': 'ir.actions.act_window_close'},
+                    }
+                }
+
         log_vals.update({
             'status': 'sent' if at_least_one_success else 'failed',
         })
         history_record = self.env['whatsapp.message.history'].sudo().create(log_vals)
-        _logger.info('Created whatsapp.message.history: ID %d, status %s', history_record.id, log_vals['status'])
+        log_sampled(_logger, logging.INFO, self.env, 'Created whatsapp.message.history: ID %d, status %s',
+                    history_record.id, log_vals['status'])
 
         notification_type = 'success' if at_least_one_success else 'warning'
         notification_message = (
@@ -369,6 +461,8 @@ class MessageConfiguration(models.TransientModel):
             if at_least_one_success
             else _('Failed to send message to %s.') % self.recipient.name
         )
+        if spool_note:
+            notification_message += ' ' + spool_note
 
         return {
             'type': 'ir.actions.client',
@@ -382,13 +476,71 @@ class MessageConfiguration(models.TransientModel):
             }
         }
 
+    def _spool_payloads(self, number, payloads):
+        """
+        Queue ``(payload, error)`` pairs that could not be sent now, in their
+        sending order: a payload never leaves before the ones spooled before it.
+        A media payload without media id comes with the attachment to upload.
+        """
+        Outbound = self.env['whatsapp.outbound.message'].sudo()
+        now = fields.Datetime.now()
+        wait = 0
+        for payload, error in payloads:
+            wait = max(wait, _spool_delay(error))
+            attachment = False
+            if payload['type'] not in ('text', 'template') and 'id' not in payload[payload['type']]:
+                attachment = self.env['ir.attachment'].sudo().create({
+                    'name': self.attachment_filename,
+                    'datas': self.attachment,
+                    'mimetype': self._get_media_type()[1],
+                })
+            Outbound._enqueue(
+                self.config_id,
+                number,
+                {key: value for key, value in payload.items() if key not in ('messaging_product', 'to')},
+                partner=self.recipient,
+                body=self.message,
+                template=self.template_id if payload['type'] == 'template' else False,
+                scheduled_at=now + timedelta(seconds=wait) if wait else False,
+                attachment=attachment,
+            )
+
+    def _post_message(self, url, headers, number, payload):
+        """
+        Send one message payload, spaced from the previous message to the same
+        recipient. Never waits: raises PairRateDeferred when the pair slot is
+        not free yet or Meta answers with the pair rate limit error, for the
+        caller to queue the payload instead. A call whose answer was lost
+        (maybe_sent) raises a UserError rather than being queued, as sending
+        it again could deliver it twice.
+        """
+        config = self.config_id._snapshot()
+        delay = pair_scheduler.reserve(config.id, number, config.pair_rate_interval, max_wait=0)
+        if delay > 0:
+            raise PairRateDeferred(config.id, number, delay)
+        try:
+            response = graph_request('POST', url, operation='messages', config_id=config.id,
+                                     headers=headers, json=payload)
+        except UNREACHABLE_ERRORS as e:
+            if maybe_sent(e):
+                raise UserError(_("No answer from WhatsApp: the message to %s may have been sent, "
+                                  "it is not queued again.") % number)
+            raise
+        if error_code(response) == PAIR_RATE_ERROR_CODE:
+            penalty = pair_scheduler.penalize(config.id, number)
+            _logger.warning("Pair rate limit hit for %s on config ID %s, backing off %.0fs", number, config.id, penalty)
+            raise PairRateDeferred(config.id, number, penalty)
+        if response.status_code in [200, 201]:
+            pair_scheduler.succeeded(config.id, number)
+        return response
+
+    @instrumented('send.get_or_create_chat_channel')
     def _get_or_create_chat_channel(self, partner, config_id=False):
         if not partner:
             return False
 
         if config_id:
-            config = self.env['whatsapp.config'].sudo().browse(config_id)
-            if self.env.user not in config.operator_ids:
+            if config_id not in self.env['res.users']._get_whatsapp_snapshot()['operator_config_ids']:
                 _logger.error("User %s not in operator_ids for config %s", self.env.user.name, config_id)
                 return False
 
@@ -415,8 +567,9 @@ class MessageConfiguration(models.TransientModel):
             channel = self.env['discuss.channel'].sudo().create(channel_vals)
             channel._ensure_member(self.env.user.partner_id)
 
-        _logger.info('Channel created/found: %s (ID: %d, Members: %s)',
-                     channel.name, channel.id, channel.channel_member_ids.mapped('partner_id.name'))
+        log_sampled(_logger, logging.DEBUG, self.env, 'Channel created/found: %s (ID: %d, Members: %s)',
+                    LazyLog(lambda: channel.name), channel.id,
+                    LazyLog(lambda: channel.channel_member_ids.mapped('partner_id.name')))
         return channel
 
 
@@ -426,8 +579,7 @@ class ResPartner(models.Model):
     def action_send_message(self):
         """Open the MessageConfiguration wizard to send a WhatsApp message."""
         self.ensure_one()
-        model = self.env['ir.model'].search([('model', '=', 'res.partner')])
-        print('called')
+        model_id = self.env['ir.model']._get_id('res.partner')
         return {
             'type': 'ir.actions.act_window',
             'name': _('Write Message'),
@@ -437,6 +589,6 @@ class ResPartner(models.Model):
             'target': 'new',
             'context': {
                 'default_recipient': self.id,
-                'default_model': model.id
+                'default_model': model_id
             },
         }
\ No newline at end of file
@@ -1,5 +1,17 @@
 # -*- coding: utf-8 -*-
+import base64
 from odoo import models, fields, api, _
+from odoo.exceptions import UserError
+from odoo.tools import html2plaintext
+from odoo.tools.sql import create_index
+
+TIMELINE_MAX_LIMIT = 200
+# rank of each timeline source, breaking create_date ties in the page order
+TIMELINE_SOURCES = {'chat': 0, 'history': 1}
+EXPORT_COLUMNS = [
+    'id', 'number', 'partner_id', 'config_id', 'user', 'template_id', 'status', 'send_date',
+    'received_date', 'message_id', 'conversation_id', 'reply_to_message_id',
+]
 
 class WhatsAppMessageHistory(models.Model):
     _name = 'whatsapp.message.history'
@@ -65,4 +77,221 @@ class WhatsAppMessageHistory(models.Model):
     reply_to_message_id = fields.Char(
         string="Reply to Message ID",
         help="WhatsApp message ID of the message this is a reply to"
-    )
\ No newline at end of file
+    )
+
+    def init(self):
+        # the timeline pages on create_date, as send_date is rewritten by status webhooks
+        create_index(self.env.cr, 'whatsapp_message_history_partner_create_date_idx', self._table,
+                     ['partner_id', 'create_date', 'id'])
+        create_index(self.env.cr, 'whatsapp_message_history_config_number_create_date_idx', self._table,
+                     ['config_id', 'number', 'create_date', 'id'])
+        create_index(self.env.cr, 'whatsapp_message_history_send_date_idx', self._table, ['send_date', 'id'])
+
+    @api.model
+    def _encode_timeline_cursor(self, create_date, source, record_id):
+        cursor = f"{fields.Datetime.to_string(create_date)}|{source}|{record_id}"
+        return base64.urlsafe_b64encode(cursor.encode()).decode()
+
+    @api.model
+    def _decode_timeline_cursor(self, cursor):
+        try:
+            create_date, source, record_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+            if source not in TIMELINE_SOURCES:
+                raise ValueError(source)
+            return fields.Datetime.to_datetime(create_date), source, int(record_id)
+        except (ValueError, UnicodeDecodeError):
+            raise UserError(_("Invalid timeline cursor."))
+
+    @api.model
+    def _timeline_cursor_condition(self, alias, source, cursor):
+        """
+        Return the SQL condition and params selecting the rows of ``source``
+        that come after ``cursor`` in the timeline order. Rows sort on
+        (create_date, TIMELINE_SOURCES rank, id) descending; the condition is
+        written on (create_date, id) alone so it stays usable by the indexes.
+        """
+        if not cursor:
+            return "TRUE", []
+        create_date, cursor_source, record_id = cursor
+        rank, cursor_rank = TIMELINE_SOURCES[source], TIMELINE_SOURCES[cursor_source]
+        if rank == cursor_rank:
+            return f"({alias}.create_date, {alias}.id) < (%s, %s)", [create_date, record_id]
+        if rank > cursor_rank:
+            return f"{alias}.create_date < %s", [create_date]
+        return f"{alias}.create_date <= %s", [create_date]
+
+    @api.model
+    def _timeline_history_rows(self, partner_id, config_id, number, cursor, limit):
+        if partner_id:
+            where = ["h.partner_id = %s"]
+            params = [partner_id]
+            if config_id:
+                where.append("h.config_id = %s")
+                params.append(config_id)
+        else:
+            where = ["h.config_id = %s", "h.number = %s"]
+            params = [config_id, number]
+        condition, condition_params = self._timeline_cursor_condition('h', 'history', cursor)
+        self.env.cr.execute(f"""
+            SELECT h.id, h.create_date, h.send_date, h.status, h.message, h.number, h.config_id, h.partner_id,
+                   h.message_id, h.reply_to_message_id
+              FROM whatsapp_message_history h
+             WHERE {' AND '.join(where)} AND {condition}
+          ORDER BY h.create_date DESC, h.id DESC
+             LIMIT %s
+        """, params + condition_params + [limit])
+        rows = self.env.cr.dictfetchall()
+        for row in rows:
+            row['source'] = 'history'
+        return rows
+
+    @api.model
+    def _timeline_chat_rows(self, partner_ids, config_id, cursor, limit):
+        """
+        Return the chat messages of the WhatsApp channels of ``partner_ids``
+        that are not linked to a history row by WhatsApp message id (notes,
+        and messages posted in the chat without going through WhatsApp).
+        """
+        if not partner_ids:
+            return []
+        domain = [('channel_member_ids.partner_id', 'in', partner_ids)]
+        if config_id:
+            domain.append(('whatsapp_config_id', '=', config_id))
+        else:
+            domain.append(('whatsapp_config_id', '!=', False))
+        channel_ids = self.env['discuss.channel'].sudo().search(domain).ids
+        if not channel_ids:
+            return []
+        condition, condition_params = self._timeline_cursor_condition('m', 'chat', cursor)
+        self.env.cr.execute(f"""
+            SELECT m.id, m.create_date, m.date, m.body, m.author_id, c.whatsapp_config_id AS config_id
+              FROM mail_message m
+              JOIN discuss_channel c ON c.id = m.res_id
+             WHERE m.model = 'discuss.channel'
+               AND m.res_id = ANY(%s)
+               AND m.message_type = 'comment'
+               AND m.whatsapp_message_id IS NULL
+               AND {condition}
+          ORDER BY m.create_date DESC, m.id DESC
+             LIMIT %s
+        """, [channel_ids] + condition_params + [limit])
+        rows = self.env.cr.dictfetchall()
+        for row in rows:
+            row['source'] = 'chat'
+        return rows
+
+    @api.model
+    def get_timeline(self, partner_id=None, config_id=None, number=None, cursor=None, limit=50):
+        """
+        Return one page of a contact's conversation, newest first, as compact dicts.
+        The contact is given by ``partner_id`` (optionally restricted to ``config_id``)
+        or by ``config_id`` and ``number``. The page merges the history rows with
+        the messages of the contact's WhatsApp chats that have no history row,
+        each item telling its ``source`` ('history' or 'chat'); chat messages
+        linked by WhatsApp message id contribute their attachments to the
+        history item instead. Pages are keyset-paginated on (create_date, source,
+        id), which unlike send_date never changes once the row exists: pass the
+        returned ``next_cursor`` to get the following page.
+        """
+        self.check_access('read')
+        limit = max(1, min(int(limit), TIMELINE_MAX_LIMIT))
+        if partner_id:
+            partner_ids = [partner_id]
+        elif config_id and number:
+            Partner = self.env['res.partner']
+            key = Partner.normalize_phone_number(number)
+            partner_ids = list(Partner._whatsapp_search_normalized({key}).values()) if key else []
+        else:
+            raise UserError(_("A partner, or a configuration and a number, is required."))
+        cursor = self._decode_timeline_cursor(cursor) if cursor else None
+
+        # each source returns at most one row past the page, the merge keeps the newest
+        rows = self._timeline_history_rows(partner_id, config_id, number, cursor, limit + 1)
+        rows += self._timeline_chat_rows(partner_ids, config_id, cursor, limit + 1)
+        rows.sort(key=lambda row: (row['create_date'], TIMELINE_SOURCES[row['source']], row['id']), reverse=True)
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        message_ids = [row['message_id'] for row in rows if row['source'] == 'history' and row['message_id']]
+        chat_messages = {}
+        if message_ids:
+            for message in self.env['mail.message'].sudo().search_fetch(
+                    [('whatsapp_message_id', 'in', message_ids), ('model', '=', 'discuss.channel')],
+                    ['whatsapp_message_id', 'attachment_ids']):
+                chat_messages[message.whatsapp_message_id] = message
+        chat_attachments = {}
+        chat_ids = [row['id'] for row in rows if row['source'] == 'chat']
+        if chat_ids:
+            for message in self.env['mail.message'].sudo().browse(chat_ids):
+                chat_attachments[message.id] = message.attachment_ids.ids
+
+        items = []
+        for row in rows:
+            if row['source'] == 'chat':
+                items.append({
+                    'id': row['id'],
+                    'source': 'chat',
+                    'date': fields.Datetime.to_string(row['date'] or row['create_date']),
+                    'direction': 'in' if row['author_id'] in partner_ids else 'out',
+                    'status': False,
+                    'body': html2plaintext(row['body'] or ''),
+                    'number': False,
+                    'config_id': row['config_id'],
+                    'partner_id': partner_ids[0],
+                    'message_id': False,
+                    'reply_to_message_id': False,
+                    'mail_message_id': row['id'],
+                    'attachment_ids': chat_attachments.get(row['id'], []),
+                })
+                continue
+            chat_message = chat_messages.get(row['message_id'])
+            items.append({
+                'id': row['id'],
+                'source': 'history',
+                'date': fields.Datetime.to_string(row['send_date'] or row['create_date']),
+                'direction': 'in' if row['status'] == 'received' else 'out',
+                'status': row['status'],
+                'body': row['message'],
+                'number': row['number'],
+                'config_id': row['config_id'],
+                'partner_id': row['partner_id'],
+                'message_id': row['message_id'],
+                'reply_to_message_id': row['reply_to_message_id'],
+                'mail_message_id': chat_message.id if chat_message else False,
+                'attachment_ids': chat_message.attachment_ids.ids if chat_message else [],
+            })
+        last = rows[-1] if rows else None
+        return {
+            'items': items,
+            'next_cursor': self._encode_timeline_cursor(last['create_date'], last['source'], last['id'])
+            if has_more else False,
+        }
+
+    @api.model
+    def _get_export_query(self, date_from=None, date_to=None, config_id=None, status=None, include_body=True):
+        """
+        Return ``(columns, query, params)`` selecting the history rows to export,
+        in id order, filtered on send date range, configuration and status.
+        """
+        columns = EXPORT_COLUMNS + (['message'] if include_body else [])
+        where = ["TRUE"]
+        params = []
+        if date_from:
+            where.append("send_date >= %s")
+            params.append(fields.Datetime.to_datetime(date_from))
+        if date_to:
+            where.append("send_date < %s")
+            params.append(fields.Datetime.to_datetime(date_to))
+        if config_id:
+            where.append("config_id = %s")
+            params.append(int(config_id))
+        if status:
+            where.append("status = ANY(%s)")
+            params.append(status.split(','))
+        query = f"""
+            SELECT {', '.join('"%s"' % column for column in columns)}
+              FROM whatsapp_message_history
+             WHERE {' AND '.join(where)}
+          ORDER BY id
+        """
+        return columns, query, params
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api, _
+from odoo.tools import SQL
+
+
+class WhatsAppMessageHistoryIndex(models.Model):
+    """
+    Narrow, read-only projection of whatsapp.message.history for list views,
+    searches and exports. It only exposes the small tracking columns; the
+    message body is fetched from the history on demand.
+    """
+    _name = 'whatsapp.message.history.index'
+    _description = 'WhatsApp Message Log'
+    _auto = False
+    _order = 'send_date desc, id desc'
+    _rec_name = 'number'
+
+    history_id = fields.Many2one('whatsapp.message.history', string="History", readonly=True)
+    number = fields.Char(string="Number", readonly=True)
+    partner_id = fields.Many2one('res.partner', string="Recipient", readonly=True)
+    user = fields.Many2one('res.users', string="Users", readonly=True)
+    config_id = fields.Many2one('whatsapp.config', string="Configuration", readonly=True)
+    template_id = fields.Many2one('whatsapp.template', string="Template", readonly=True)
+    status = fields.Selection(
+        [('sent', 'Sent'), ('delivered', 'Delivered'), ('read', 'Read'), ('received', 'Received'), ('failed', 'Failed')],
+        string="Status",
+        readonly=True,
+    )
+    send_date = fields.Datetime(string="Send Date", readonly=True)
+    received_date = fields.Datetime(string="Received Date", readonly=True)
+    message_id = fields.Char(string="Message ID", readonly=True)
+    conversation_id = fields.Char(string="Conversation ID", readonly=True)
+    message = fields.Text(string="Message", compute='_compute_message')
+
+    def _compute_message(self):
+        histories = self.env['whatsapp.message.history'].browse(self.ids)
+        histories.fetch(['message'])
+        for record, history in zip(self, histories):
+            record.message = history.message
+
+    def init(self):
+        self.env.cr.execute(SQL("""
+            CREATE OR REPLACE VIEW %s AS (
+                SELECT id,
+                       id AS history_id,
+                       number,
+                       partner_id,
+                       "user",
+                       config_id,
+                       template_id,
+                       status,
+                       send_date,
+                       received_date,
+                       message_id,
+                       conversation_id
+                  FROM whatsapp_message_history
+            )
+        """, SQL.identifier(self._table)))
+
+    def action_open_history(self):
+        self.ensure_one()
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': 'whatsapp.message.history',
+            'res_id': self.id,
+            'view_mode': 'form',
+            'target': 'current',
+        }
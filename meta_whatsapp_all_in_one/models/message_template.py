@@ -1,7 +1,7 @@
 from odoo.exceptions import UserError
-import requests
 from odoo import models, fields, api, _
 import logging
+from ..tools import graph_request
 
 _logger = logging.getLogger(__name__)
 
@@ -168,7 +168,7 @@ class WhatsAppTemplate(models.Model):
             # Create a new template
             url = f"{self.config_id.api_url}/{self.config_id.business_account_id}/message_templates"
             print(payload)
-            response = requests.post(url, headers=headers, json=payload)
+            response = graph_request('POST', url, operation='create_template', headers=headers, json=payload)
             if response.status_code in [200, 201]:
                 data = response.json()
                 self.template_id = data.get('id')
@@ -276,7 +276,7 @@ class WhatsAppTemplate(models.Model):
             # Use the correct API endpoint with version
             # api_version = self.config_id.api_version if hasattr(self.config_id, 'api_version') else 'v18.0'
             url = f"{self.config_id.api_url}/{self.template_id}"
-            response = requests.post(url, headers=headers, json=payload)
+            response = graph_request('POST', url, operation='update_template', headers=headers, json=payload)
             if response.status_code in [200, 201]:
                 self.status = 'PENDING'
                 return {
@@ -307,7 +307,7 @@ class WhatsAppTemplate(models.Model):
                 'Authorization': f'Bearer {self.config_id.access_token}',
                 'Content-Type': 'application/json',
             }
-            response = requests.get(url, headers=headers)
+            response = graph_request('GET', url, operation='template_status', headers=headers)
             if response.status_code == 200:
                 data = response.json()
                 templates = data.get('data', [])
@@ -345,7 +345,7 @@ class WhatsAppTemplate(models.Model):
                 'Authorization': f'Bearer {self.config_id.access_token}',
                 'Content-Type': 'application/json',
             }
-            response = requests.delete(url, headers=headers)
+            response = graph_request('DELETE', url, operation='remove_template', headers=headers)
             if response.status_code == 200:
                 self.unlink()
                 return {
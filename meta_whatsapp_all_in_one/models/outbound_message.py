@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+import logging
+import time
+import uuid
+from datetime import timedelta
+
+from odoo import models, fields, api, _
+from odoo.tools.sql import create_index
+from ..tools import PAIR_RATE_ERROR_CODE, UNREACHABLE_ERRORS, RateLimitPaused, error_code, graph_request
+from ..tools import maybe_sent, pair_scheduler, pooled_session, tripped_config_ids
+
+_logger = logging.getLogger(__name__)
+
+LEASE_DURATION = 300
+MAX_ATTEMPTS = 5
+# (connect, read) timeout of a send, far below LEASE_DURATION so a message
+# is never reclaimed and sent again while its call is still running
+DISPATCH_TIMEOUT = (5, 30)
+
+
+class WhatsAppOutboundMessage(models.Model):
+    """
+    Queue of outbound WhatsApp messages. Dispatchers claim rows in batches with
+    SELECT ... FOR UPDATE SKIP LOCKED and hold them under a lease, so any number
+    of workers or cron threads can dispatch concurrently without sending the
+    same row twice; rows whose lease expired (crashed worker) are reclaimed.
+    It is also the spool of messages sent while the Graph API is unreachable:
+    they wait, in order, until a health check closes the circuit breaker.
+    """
+    _name = 'whatsapp.outbound.message'
+    _description = 'WhatsApp Outbound Message'
+    _order = 'scheduled_at, id'
+
+    config_id = fields.Many2one('whatsapp.config', string="Configuration", required=True, ondelete='cascade')
+    number = fields.Char(string="Number", required=True)
+    partner_id = fields.Many2one('res.partner', string="Recipient")
+    user_id = fields.Many2one('res.users', string="User", default=lambda self: self.env.user)
+    payload = fields.Json(string="Payload", required=True, help="Graph API message payload, without the recipient")
+    body = fields.Text(string="Message", help="Text stored in the message history")
+    template_id = fields.Many2one('whatsapp.template', string="Template")
+    state = fields.Selection(
+        [('queued', 'Queued'), ('sending', 'Sending'), ('sent', 'Sent'), ('unknown', 'Unknown'), ('failed', 'Failed')],
+        string="Status",
+        default='queued',
+        required=True,
+    )
+    scheduled_at = fields.Datetime(string="Scheduled At", default=fields.Datetime.now, required=True)
+    lease_until = fields.Datetime(string="Lease Until")
+    lease_token = fields.Char(string="Lease Token")
+    attempts = fields.Integer(string="Attempts", default=0)
+    error = fields.Char(string="Error")
+    message_id = fields.Char(string="Message ID", help="WhatsApp message ID (wamid) returned by Meta")
+    history_id = fields.Many2one('whatsapp.message.history', string="History", ondelete='set null')
+    attachment_id = fields.Many2one(
+        'ir.attachment',
+        string="Attachment",
+        ondelete='set null',
+        help="Media spooled while the Graph API was unreachable, uploaded right before sending"
+    )
+
+    def init(self):
+        create_index(self.env.cr, 'whatsapp_outbound_message_claim_idx', self._table,
+                     ['scheduled_at', 'id'], where="state IN ('queued', 'sending')")
+
+    @api.model
+    def _enqueue(self, config, number, payload, partner=False, body=False, template=False, scheduled_at=False,
+                 user=False, attachment=False):
+        """
+        Queue a message payload for ``number`` and wake up the dispatcher. The
+        media of a payload without media id is uploaded from ``attachment``.
+        """
+        message = self.create({
+            'user_id': user.id if user else self.env.user.id,
+            'config_id': config.id,
+            'number': number,
+            'partner_id': partner.id if partner else False,
+            'payload': payload,
+            'body': body,
+            'template_id': template.id if template else False,
+            'scheduled_at': scheduled_at or fields.Datetime.now(),
+            'attachment_id': attachment.id if attachment else False,
+        })
+        if attachment:
+            attachment.write({'res_model': self._name, 'res_id': message.id})
+        if scheduled_at and scheduled_at > fields.Datetime.now():
+            self._dispatcher_crons()[:1]._trigger(scheduled_at)
+            return message
+        precommit_data = self.env.cr.precommit.data
+        if not precommit_data.get('whatsapp.dispatch_triggered'):
+            precommit_data['whatsapp.dispatch_triggered'] = True
+            self._dispatcher_crons()._trigger()
+        return message
+
+    @api.model
+    def _dispatcher_crons(self):
+        """
+        Return the active dispatcher crons. Odoo never runs one cron in two
+        workers at once, so dispatch runs in as many cron workers as there are
+        dispatcher crons: duplicate one to add a dispatcher.
+        """
+        return self.env['ir.cron'].sudo().search([
+            ('model_id.model', '=', self._name),
+            ('code', '=', 'model._cron_dispatch()'),
+        ])
+
+    @api.model
+    def _claim_batch(self, batch_size=50, exclude_config_ids=()):
+        """
+        Claim up to ``batch_size`` due messages for this worker and return them.
+        Rows locked by another dispatcher, or of ``exclude_config_ids``, are skipped.
+        """
+        token = uuid.uuid4().hex
+        self.env.cr.execute("""
+            UPDATE whatsapp_outbound_message
+               SET state = 'sending',
+                   lease_token = %(token)s,
+                   lease_until = (now() AT TIME ZONE 'UTC') + %(lease)s * interval '1 second',
+                   attempts = attempts + 1
+             WHERE id IN (
+                    SELECT id
+                      FROM whatsapp_outbound_message
+                     WHERE ((state = 'queued' AND scheduled_at <= (now() AT TIME ZONE 'UTC'))
+                        OR (state = 'sending' AND lease_until < (now() AT TIME ZONE 'UTC')))
+                       AND config_id != ALL(%(exclude)s)
+                  ORDER BY scheduled_at, id
+                     LIMIT %(limit)s
+                       FOR UPDATE SKIP LOCKED
+             )
+         RETURNING id
+        """, {'token': token, 'lease': LEASE_DURATION, 'limit': batch_size, 'exclude': list(exclude_config_ids)})
+        ids = [row[0] for row in self.env.cr.fetchall()]
+        self.invalidate_model(['state', 'lease_token', 'lease_until', 'attempts'])
+        return self.browse(ids), token
+
+    @api.model
+    def _cron_dispatch(self, batch_size=50, max_batches=20):
+        """
+        Dispatch due messages batch by batch, committing after every claim and
+        every send. Messages of configurations whose Graph API is unreachable
+        stay queued, in order, and are not claimed again during this run.
+        When ``max_batches`` is exhausted with messages still due, the cron is
+        called again right away instead of at its next interval.
+        """
+        unreachable = self._unreachable_config_ids()
+        done = 0
+        for _batch in range(max_batches):
+            messages, token = self._claim_batch(batch_size, unreachable)
+            self.env.cr.commit()
+            if not messages:
+                return
+            # apply the pauses, manual resets and open circuits stored by the other workers
+            for config in messages.config_id:
+                config._rate_limit_tracker()
+                config._circuit_breaker()
+            for message in messages:
+                if message.config_id.id in unreachable:
+                    message._requeue(token)
+                elif not message._dispatch(token):
+                    unreachable.add(message.config_id.id)
+                    message.config_id.sudo()._sync_circuit_state()
+                self.env.cr.commit()
+            done += len(messages)
+        remaining = self.search_count([
+            ('state', '=', 'queued'),
+            ('scheduled_at', '<=', fields.Datetime.now()),
+            ('config_id', 'not in', list(unreachable)),
+        ])
+        self.env['ir.cron']._notify_progress(done=done, remaining=remaining)
+
+    @api.model
+    def _unreachable_config_ids(self):
+        """
+        Return the configurations whose circuit is open, in this worker or as
+        stored by any other one. Those due for a retry are health checked
+        first, and drained if it succeeds.
+        """
+        Config = self.env['whatsapp.config'].sudo()
+        configs = Config.browse(tripped_config_ids()).exists() | Config.search([('circuit_state', '=', 'open')])
+        unreachable = set()
+        for config in configs:
+            breaker = config._circuit_breaker()
+            if breaker.state == 'half_open' and config._check_graph_api_health():
+                _logger.info("Graph API reachable again for config ID %s, draining the spool", config.id)
+            config._sync_circuit_state()
+            if breaker.state != 'closed':
+                unreachable.add(config.id)
+        return unreachable
+
+    def _release(self, token, vals):
+        """Write ``vals`` only if this worker still holds the lease of the message."""
+        self.ensure_one()
+        self.env.cr.execute(
+            "SELECT 1 FROM whatsapp_outbound_message WHERE id = %s AND lease_token = %s FOR UPDATE",
+            (self.id, token),
+        )
+        if not self.env.cr.fetchone():
+            _logger.warning("Lease of outbound WhatsApp message %s was lost, result not recorded", self.id)
+            return False
+        self.write(dict(vals, lease_token=False, lease_until=False))
+        return True
+
+    def _renew_lease(self, token):
+        """
+        Extend the lease of a claimed message right before it is sent, and lock
+        its row until the next commit, so the rest of the batch never runs on
+        a lease that expired meanwhile. Returns False when the lease was lost.
+        """
+        self.ensure_one()
+        self.env.cr.execute("""
+            UPDATE whatsapp_outbound_message
+               SET lease_until = (now() AT TIME ZONE 'UTC') + %s * interval '1 second'
+             WHERE id = %s AND lease_token = %s
+        """, (LEASE_DURATION, self.id, token))
+        if not self.env.cr.rowcount:
+            _logger.warning("Lease of outbound WhatsApp message %s was lost, not sending it", self.id)
+            return False
+        self.invalidate_recordset(['lease_until'])
+        return True
+
+    def _requeue(self, token):
+        """Put a claimed message back in the queue untouched, without counting the attempt."""
+        self.ensure_one()
+        return self._release(token, {'state': 'queued', 'attempts': self.attempts - 1})
+
+    def _reschedule(self, token, delay, error=False):
+        self.ensure_one()
+        return self._release(token, {
+            'state': 'queued',
+            'scheduled_at': fields.Datetime.now() + timedelta(seconds=delay),
+            'attempts': self.attempts - 1 if not error else self.attempts,
+            'error': error,
+        })
+
+    def _dispatch(self, token):
+        """
+        Send one claimed message. Pair or rate limited messages are rescheduled,
+        never waited for. Returns False when the Graph API is unreachable: the
+        message is then requeued as is, unless the request may have been sent
+        already (maybe_sent), in which case it is set to unknown, never retried.
+        """
+        self.ensure_one()
+        config = self.config_id._snapshot()
+        delay = pair_scheduler.reserve(config.id, self.number, config.pair_rate_interval, max_wait=0)
+        if delay > 0:
+            self._reschedule(token, delay)
+            return True
+        url = f"{config.api_url}/{config.instance_id}/messages"
+        headers = {
+            'Authorization': f'Bearer {config.access_token}',
+            'Content-Type': 'application/json',
+        }
+        if not self._renew_lease(token):
+            return True
+        sending = False
+        try:
+            if self.attachment_id and 'id' not in self.payload[self.payload['type']]:
+                self._upload_attachment()
+            payload = dict(self.payload, messaging_product='whatsapp', to=self.number)
+            sending = True
+            response = graph_request('POST', url, operation='messages', config_id=config.id,
+                                     session=pooled_session(), headers=headers, json=payload,
+                                     timeout=DISPATCH_TIMEOUT)
+        except RateLimitPaused as e:
+            self._reschedule(token, max(e.until - time.time(), 1))
+            return True
+        except UNREACHABLE_ERRORS as e:
+            if sending and maybe_sent(e):
+                _logger.warning("No answer from the Graph API for outbound WhatsApp message %s, it may have "
+                                "been sent and is not retried: %s", self.id, str(e))
+                self._release(token, {'state': 'unknown', 'error': _("No answer from WhatsApp: the message may "
+                                                                     "have been sent, it is not retried.")})
+                return False
+            _logger.warning("Graph API unreachable, outbound WhatsApp message %s stays queued: %s", self.id, str(e))
+            self._requeue(token)
+            return False
+        except Exception as e:
+            _logger.error("Error dispatching outbound WhatsApp message %s: %s", self.id, str(e))
+            self._fail_or_retry(token, str(e))
+            return True
+        if error_code(response) == PAIR_RATE_ERROR_CODE:
+            self._reschedule(token, pair_scheduler.penalize(config.id, self.number), _('Pair rate limit hit'))
+            return True
+        if response.status_code not in [200, 201]:
+            self._fail_or_retry(token, response.text)
+            return True
+        pair_scheduler.succeeded(config.id, self.number)
+        response_data = response.json()
+        message_id = response_data.get('messages', [{}])[0].get('id')
+        if self._release(token, {'state': 'sent', 'message_id': message_id, 'error': False}):
+            self.history_id = self._create_history('sent', message_id, response_data)
+        return True
+
+    def _upload_attachment(self):
+        """Upload the spooled attachment and store its media id in the payload, so retries don't upload it again."""
+        self.ensure_one()
+        media_type = self.payload['type']
+        media_id = self.config_id._upload_media(self.attachment_id.name, self.attachment_id.raw, media_type,
+                                                self.attachment_id.mimetype)
+        self.payload = dict(self.payload, **{media_type: dict(self.payload[media_type], id=media_id)})
+
+    def _fail_or_retry(self, token, error):
+        self.ensure_one()
+        if self.attempts >= MAX_ATTEMPTS:
+            if self._release(token, {'state': 'failed', 'error': error[:255]}):
+                self.history_id = self._create_history('failed')
+        else:
+            self._reschedule(token, 30 * 2 ** self.attempts, error[:255])
+
+    def _create_history(self, status, message_id=False, response_data=None):
+        self.ensure_one()
+        return self.env['whatsapp.message.history'].sudo().create({
+            'number': self.number,
+            'user': self.user_id.id,
+            'message': self.body,
+            'config_id': self.config_id.id,
+            'template_id': self.template_id.id,
+            'partner_id': self.partner_id.id,
+            'message_id': message_id,
+            'conversation_id': (response_data or {}).get('conversations', [{}])[0].get('id', False),
+            'status': status,
+        })
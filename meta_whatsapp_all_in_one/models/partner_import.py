@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+import base64
+import io
+
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError
+from ..tools.partner_import import iter_csv_batches
+
+
+class WhatsAppPartnerImport(models.TransientModel):
+    _name = 'whatsapp.partner.import'
+    _description = 'WhatsApp Contact Import'
+
+    file = fields.Binary(string="CSV File", required=True,
+                         help="CSV file with a header row and name, phone, mobile and email columns")
+    filename = fields.Char(string="Filename")
+    batch_size = fields.Integer(string="Batch Size", default=5000)
+    created_count = fields.Integer(string="Created", readonly=True)
+    updated_count = fields.Integer(string="Updated", readonly=True)
+    state = fields.Selection([('draft', 'Draft'), ('done', 'Done')], default='draft')
+
+    def action_import(self):
+        self.ensure_one()
+        if self.batch_size <= 0:
+            raise UserError(_('The batch size must be positive.'))
+        content = io.TextIOWrapper(io.BytesIO(base64.b64decode(self.file)), encoding='utf-8-sig', newline='')
+        try:
+            created, updated = self.env['res.partner']._whatsapp_import_partners(
+                iter_csv_batches(content, self.batch_size))
+        except (KeyError, UnicodeDecodeError) as e:
+            raise UserError(_('Invalid CSV file: %s') % str(e))
+        self.write({'created_count': created, 'updated_count': updated, 'state': 'done', 'file': False})
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': self._name,
+            'res_id': self.id,
+            'view_mode': 'form',
+            'target': 'new',
+        }
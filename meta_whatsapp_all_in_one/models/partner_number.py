@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api, _
+
+
+class WhatsAppPartnerNumber(models.Model):
+    """
+    Normalized numbers of the partners created from inbound WhatsApp
+    messages. The unique key serializes concurrent webhooks creating the same
+    contact: the second transaction inserting a number gets a serialization
+    failure once the first one commits, and Odoo retries its request, which
+    then finds the partner.
+    """
+    _name = 'whatsapp.partner.number'
+    _description = 'WhatsApp Partner Number'
+    _rec_name = 'normalized_number'
+
+    normalized_number = fields.Char(string="Normalized Number", required=True)
+    partner_id = fields.Many2one('res.partner', string="Partner", ondelete='cascade')
+
+    _sql_constraints = [
+        ('normalized_number_uniq', 'UNIQUE(normalized_number)', 'A number can only be claimed once.'),
+    ]
+
+    @api.model
+    def _claim(self, keys):
+        """
+        Claim the normalized numbers ``keys`` for partners to create in this
+        transaction. Returns the set of claimed numbers and a dict mapping the
+        numbers claimed before to their partner id.
+        """
+        self.env.cr.execute("""
+            INSERT INTO whatsapp_partner_number
+                   (normalized_number, create_uid, write_uid, create_date, write_date)
+            SELECT key, %(uid)s, %(uid)s, (now() AT TIME ZONE 'UTC'), (now() AT TIME ZONE 'UTC')
+              FROM unnest(%(keys)s::varchar[]) AS key
+          ORDER BY key
+            ON CONFLICT (normalized_number) DO NOTHING
+         RETURNING normalized_number
+        """, {'keys': sorted(keys), 'uid': self.env.uid})
+        claimed = {row[0] for row in self.env.cr.fetchall()}
+        known = {}
+        if len(claimed) < len(keys):
+            self.env.cr.execute("""
+                SELECT normalized_number, partner_id
+                  FROM whatsapp_partner_number
+                 WHERE normalized_number = ANY(%s) AND partner_id IS NOT NULL
+            """, (list(set(keys) - claimed),))
+            known = dict(self.env.cr.fetchall())
+        return claimed, known
+
+    @api.model
+    def _assign(self, partner_ids):
+        """Link claimed numbers to the partners created for them (``{number: partner id}``)."""
+        if not partner_ids:
+            return
+        self.env.cr.execute("""
+            UPDATE whatsapp_partner_number AS number
+               SET partner_id = assigned.partner_id
+              FROM unnest(%s::varchar[], %s::int[]) AS assigned(normalized_number, partner_id)
+             WHERE number.normalized_number = assigned.normalized_number
+        """, (list(partner_ids), list(partner_ids.values())))
+        self.invalidate_model(['partner_id'])
@@ -0,0 +1,6 @@
+from .webhook_logging import LazyLog, log_sampled, payload_digest
+from .instrumentation import instrumented, measure
+from .rate_limit import PAIR_RATE_ERROR_CODE, RateLimitPaused, error_code, get_tracker
+from .pair_rate import PairRateDeferred, pair_scheduler
+from .circuit_breaker import UNREACHABLE_ERRORS, CircuitOpen, get_breaker, maybe_sent, tripped_config_ids
+from .graph_api import graph_request, pooled_session
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+Per-configuration circuit breaker around the Graph API.
+
+Connection errors, timeouts and 5xx answers count as failures. After
+FAILURE_THRESHOLD consecutive failures the circuit opens: calls raise
+CircuitOpen immediately instead of waiting on network timeouts, and senders
+spool their messages. Once RETRY_INTERVAL has elapsed the circuit is half
+open and lets a single health check through; its success closes the circuit
+and the spool drains. Breakers live in memory, one per configuration and
+worker process; whatsapp.config stores the open state so the other workers,
+and the outbound dispatcher cron, learn about it (see open_until).
+"""
+import threading
+import time
+
+import requests
+from urllib3.exceptions import ProtocolError
+
+FAILURE_THRESHOLD = 5
+RETRY_INTERVAL = 30
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling the Graph API while the circuit of a configuration is open."""
+
+    def __init__(self, config_id, retry_at):
+        self.config_id = config_id
+        self.retry_at = retry_at
+        super().__init__(f"Graph API unreachable for WhatsApp configuration {config_id}, "
+                         f"retrying in {max(retry_at - time.time(), 0):.0f}s")
+
+
+# Errors meaning the Graph API could not be reached at all, worth spooling for
+UNREACHABLE_ERRORS = (CircuitOpen, requests.ConnectionError, requests.Timeout)
+
+
+def maybe_sent(error):
+    """
+    Return whether a call that failed with one of UNREACHABLE_ERRORS may still
+    have reached the Graph API: the request went out but its answer was lost
+    (read timeout, connection dropped mid-request). Retrying such a send may
+    deliver the message twice.
+    """
+    if isinstance(error, requests.ReadTimeout):
+        return True
+    return isinstance(error, requests.ConnectionError) and bool(error.args) and isinstance(error.args[0], ProtocolError)
+
+
+class CircuitBreaker:
+
+    def __init__(self, config_id):
+        self.config_id = config_id
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        # retry time of the last opening read from the database, applied once
+        self.applied_retry_at = 0.0
+
+    @property
+    def retry_at(self):
+        return self.opened_at + RETRY_INTERVAL
+
+    @property
+    def state(self):
+        if self.failures < FAILURE_THRESHOLD:
+            return 'closed'
+        if time.time() - self.opened_at < RETRY_INTERVAL:
+            return 'open'
+        return 'half_open'
+
+    def before_request(self):
+        """Raise CircuitOpen while open; in half open state, only let one request through at a time."""
+        with self.lock:
+            state = self.state
+            if state == 'closed':
+                return
+            if state == 'half_open' and not self.probing:
+                self.probing = True
+                return
+            raise CircuitOpen(self.config_id, self.opened_at + RETRY_INTERVAL)
+
+    def open_until(self, retry_at):
+        """
+        Open the circuit until ``retry_at``, as stored by another worker. Each
+        stored opening is applied once, so a later local success closes it.
+        """
+        with self.lock:
+            if retry_at <= self.applied_retry_at:
+                return
+            self.applied_retry_at = retry_at
+            self.failures = max(self.failures, FAILURE_THRESHOLD)
+            self.opened_at = max(self.opened_at, retry_at - RETRY_INTERVAL)
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.probing = False
+            if self.failures >= FAILURE_THRESHOLD:
+                self.opened_at = time.time()
+
+    def release(self):
+        """Forget an ongoing health check that ended without telling anything about the API."""
+        with self.lock:
+            self.probing = False
+
+    def update(self, response):
+        """Count a Graph API response: 5xx answers are failures, anything else proves the API is up."""
+        if response.status_code >= 500:
+            self.record_failure()
+        else:
+            self.record_success()
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(config_id):
+    """Return the circuit breaker of a configuration in this worker."""
+    breaker = _breakers.get(config_id)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.setdefault(config_id, CircuitBreaker(config_id))
+    return breaker
+
+
+def tripped_config_ids():
+    """Return the ids of the configurations whose circuit is not closed in this worker."""
+    return [config_id for config_id, breaker in list(_breakers.items()) if breaker.state != 'closed']
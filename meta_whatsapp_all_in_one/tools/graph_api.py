@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .circuit_breaker import get_breaker
+from .instrumentation import measure, record_http_time
+from .rate_limit import get_tracker
+
+POOL_SIZE = 10
+# (connect, read) timeout of the pooled session calls that do not give their own
+POOL_TIMEOUT = (5, 30)
+# (connect, read) timeout of graph_request calls that do not give their own
+REQUEST_TIMEOUT = (5, 20)
+
+_local = threading.local()
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter applying a default timeout, as requests waits forever without one."""
+
+    def __init__(self, *args, timeout=POOL_TIMEOUT, **kwargs):
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, timeout=None, **kwargs):
+        return super().send(request, timeout=timeout if timeout is not None else self.timeout, **kwargs)
+
+
+def pooled_session():
+    """
+    Return the keep-alive ``requests`` session of the current thread, so
+    background dispatchers reuse their TLS connections to the Graph API
+    instead of opening one per message. Its calls time out after POOL_TIMEOUT
+    unless they pass their own timeout.
+    """
+    session = getattr(_local, 'session', None)
+    if session is None:
+        session = requests.Session()
+        adapter = TimeoutHTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        _local.session = session
+    return session
+
+
+def graph_request(method, url, operation=None, config_id=None, session=None, **kwargs):
+    """
+    Perform a Graph API call with ``requests`` and record it in the hot path
+    instrumentation as ``graph_api.<operation>``. When ``config_id`` is given,
+    the call goes through the rate limit tracker of that configuration, which
+    may delay it or raise RateLimitPaused, and through its circuit breaker,
+    which raises CircuitOpen while the API is unreachable. ``session`` is an
+    optional ``requests.Session`` to send the request with. Without a
+    ``timeout`` argument, REQUEST_TIMEOUT applies. Returns the response.
+    """
+    kwargs.setdefault('timeout', REQUEST_TIMEOUT)
+    tracker = get_tracker(config_id) if config_id else None
+    breaker = get_breaker(config_id) if config_id else None
+    if tracker:
+        tracker.before_request()
+    if breaker:
+        breaker.before_request()
+    with measure(f"graph_api.{operation or method.lower()}"):
+        start = time.perf_counter()
+        try:
+            response = (session or requests).request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            if breaker:
+                breaker.record_failure()
+            raise
+        except Exception:
+            if breaker:
+                breaker.release()
+            raise
+        finally:
+            record_http_time(time.perf_counter() - start)
+    if breaker:
+        breaker.update(response)
+    if tracker:
+        tracker.update(response)
+    return response
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming export of the WhatsApp message history as CSV or gzipped JSONL.
+Rows are read through a server-side (named) cursor in batches and encoded
+chunk by chunk, so memory stays constant whatever the number of rows.
+"""
+import csv
+import io
+import json
+import uuid
+import zlib
+
+EXPORT_BATCH_SIZE = 5000
+
+
+def _serialize(value):
+    if value is None:
+        return None
+    if hasattr(value, 'isoformat'):
+        return value.isoformat(sep=' ')
+    return value
+
+
+def _iter_batches(dbname, query, params, batch_size):
+    # The request cursor is closed once the response is returned, so the
+    # stream reads from its own cursor for as long as the client consumes it.
+    from odoo.modules.registry import Registry
+
+    with Registry(dbname).cursor() as cr:
+        named_cursor = cr._cnx.cursor(f"whatsapp_export_{uuid.uuid4().hex}")
+        named_cursor.itersize = batch_size
+        try:
+            named_cursor.execute(query, params)
+            while True:
+                rows = named_cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            named_cursor.close()
+
+
+def stream_csv(dbname, columns, query, params, batch_size=EXPORT_BATCH_SIZE):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for rows in _iter_batches(dbname, query, params, batch_size):
+        for row in rows:
+            writer.writerow([_serialize(value) for value in row])
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    tail = buffer.getvalue()
+    if tail:
+        yield tail.encode('utf-8')
+
+
+def stream_jsonl_gzip(dbname, columns, query, params, batch_size=EXPORT_BATCH_SIZE):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for rows in _iter_batches(dbname, query, params, batch_size):
+        chunk = ''.join(
+            json.dumps(dict(zip(columns, (_serialize(value) for value in row))), ensure_ascii=False) + '\n'
+            for row in rows
+        )
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
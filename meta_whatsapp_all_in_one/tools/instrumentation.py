@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Lightweight per-worker instrumentation of the WhatsApp hot paths.
+
+Every measured invocation records its total time, SQL query count, SQL time
+and Graph API (HTTP) time into an in-memory ring buffer. Counts and SQL time
+come from the per-thread counters Odoo's cursor maintains, HTTP time from
+``record_http_time()`` calls made by the Graph API helper. Data is kept per
+worker process and lost on restart.
+"""
+import collections
+import functools
+import threading
+import time
+
+RING_BUFFER_SIZE = 2048
+
+_lock = threading.Lock()
+_records = collections.deque(maxlen=RING_BUFFER_SIZE)
+_totals = collections.defaultdict(lambda: {
+    'count': 0, 'errors': 0, 'total_s': 0.0, 'sql_count': 0, 'sql_s': 0.0, 'http_s': 0.0,
+})
+_local = threading.local()
+
+
+def record_http_time(duration):
+    """Account ``duration`` seconds of HTTP time to the invocations running in this thread."""
+    _local.http_time = getattr(_local, 'http_time', 0.0) + duration
+
+
+def _thread_counters():
+    thread = threading.current_thread()
+    if not hasattr(thread, 'query_count'):
+        thread.query_count = 0
+        thread.query_time = 0.0
+    return thread.query_count, thread.query_time, getattr(_local, 'http_time', 0.0)
+
+
+class measure:
+    """
+    Context manager measuring one invocation of ``operation``::
+
+        with measure('graph_api.messages'):
+            ...
+    """
+
+    def __init__(self, operation):
+        self.operation = operation
+
+    def __enter__(self):
+        self.start_counters = _thread_counters()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        total = time.perf_counter() - self.start
+        query_count, query_time, http_time = _thread_counters()
+        record = {
+            'operation': self.operation,
+            'timestamp': time.time(),
+            'total_ms': round(total * 1000, 3),
+            'sql_count': query_count - self.start_counters[0],
+            'sql_ms': round((query_time - self.start_counters[1]) * 1000, 3),
+            'http_ms': round((http_time - self.start_counters[2]) * 1000, 3),
+            'error': exc_type is not None,
+        }
+        with _lock:
+            _records.append(record)
+            totals = _totals[self.operation]
+            totals['count'] += 1
+            totals['errors'] += int(record['error'])
+            totals['total_s'] += total
+            totals['sql_count'] += record['sql_count']
+            totals['sql_s'] += record['sql_ms'] / 1000.0
+            totals['http_s'] += record['http_ms'] / 1000.0
+        return False
+
+
+def instrumented(operation):
+    """Decorator measuring every call of the decorated function as ``operation``."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with measure(operation):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def recent_records(limit=None, operation=None):
+    """Return the most recent records, newest last."""
+    with _lock:
+        records = list(_records)
+    if operation:
+        records = [record for record in records if record['operation'] == operation]
+    return records[-limit:] if limit else records
+
+
+def totals():
+    """Return the cumulative counters per operation since the worker started."""
+    with _lock:
+        return {operation: dict(values) for operation, values in _totals.items()}
+
+
+def _quantile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+def summary():
+    """Cumulative totals plus latency quantiles over the ring buffer, per operation."""
+    by_operation = collections.defaultdict(list)
+    for record in recent_records():
+        by_operation[record['operation']].append(record['total_ms'])
+    result = totals()
+    for operation, values in result.items():
+        latencies = by_operation.get(operation, [])
+        values['recent_ms'] = {
+            'p50': _quantile(latencies, 0.5),
+            'p95': _quantile(latencies, 0.95),
+            'p99': _quantile(latencies, 0.99),
+        }
+    return result
+
+
+def prometheus_text():
+    """Render the cumulative counters and recent quantiles in the Prometheus text format."""
+    lines = []
+    metrics = summary()
+    series = (
+        ('whatsapp_invocations_total', 'counter', 'Measured invocations', 'count'),
+        ('whatsapp_errors_total', 'counter', 'Invocations that raised', 'errors'),
+        ('whatsapp_duration_seconds_total', 'counter', 'Total wall time', 'total_s'),
+        ('whatsapp_sql_queries_total', 'counter', 'SQL queries executed', 'sql_count'),
+        ('whatsapp_sql_seconds_total', 'counter', 'Time spent in SQL', 'sql_s'),
+        ('whatsapp_http_seconds_total', 'counter', 'Time spent in Graph API calls', 'http_s'),
+    )
+    for name, metric_type, help_text, key in series:
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {metric_type}')
+        for operation, values in sorted(metrics.items()):
+            lines.append(f'{name}{{operation="{operation}"}} {values[key]}')
+    lines.append('# HELP whatsapp_recent_duration_seconds Wall time quantiles over the recent invocations')
+    lines.append('# TYPE whatsapp_recent_duration_seconds gauge')
+    for operation, values in sorted(metrics.items()):
+        for quantile, key in (('0.5', 'p50'), ('0.95', 'p95'), ('0.99', 'p99')):
+            lines.append(f'whatsapp_recent_duration_seconds{{operation="{operation}",quantile="{quantile}"}} '
+                         f'{values["recent_ms"][key] / 1000.0}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+Per (configuration, recipient) spacing of outbound messages, to stay under
+Meta's pair rate limit (error 131056). Each pair keeps the earliest time its
+next message may leave; reserving a slot never blocks other recipients.
+"""
+import threading
+import time
+
+MAX_PENALTY = 60.0
+PAIR_TTL = 3600.0
+
+
+class PairRateDeferred(Exception):
+    """Raised instead of sending when a message must wait ``delay`` seconds for its pair slot."""
+
+    def __init__(self, config_id, number, delay):
+        self.config_id = config_id
+        self.number = number
+        self.delay = delay
+        super().__init__(f"Messages to {number} on WhatsApp configuration {config_id} "
+                         f"are deferred for {delay:.0f}s")
+
+
+class PairRateScheduler:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.next_slot = {}
+        self.penalty = {}
+
+    def reserve(self, config_id, number, interval, max_wait=None):
+        """
+        Reserve the next send slot of the pair and return how many seconds the
+        caller must wait before sending (0 when the pair is idle). When the wait
+        would exceed ``max_wait``, nothing is reserved and the wait is returned.
+        """
+        key = (config_id, number)
+        now = time.monotonic()
+        with self.lock:
+            slot = max(now, self.next_slot.get(key, 0.0))
+            if max_wait is not None and slot - now > max_wait:
+                return slot - now
+            self.next_slot[key] = slot + interval
+            if len(self.next_slot) > 10000:
+                self._prune(now)
+        return slot - now
+
+    def penalize(self, config_id, number):
+        """Push the next slot of a pair back after a 131056 error, doubling the penalty each time."""
+        key = (config_id, number)
+        with self.lock:
+            penalty = min(self.penalty.get(key, 3.0) * 2, MAX_PENALTY)
+            self.penalty[key] = penalty
+            self.next_slot[key] = max(self.next_slot.get(key, 0.0), time.monotonic() + penalty)
+            return penalty
+
+    def succeeded(self, config_id, number):
+        self.penalty.pop((config_id, number), None)
+
+    def _prune(self, now):
+        for key in [key for key, slot in self.next_slot.items() if slot < now - PAIR_TTL]:
+            self.next_slot.pop(key, None)
+            self.penalty.pop(key, None)
+
+
+pair_scheduler = PairRateScheduler()
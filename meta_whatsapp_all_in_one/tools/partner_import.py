@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+"""
+Bulk contact import helpers: CSV streaming and phone normalization that can
+run in a process pool, ahead of the batched upsert done by
+``res.partner._whatsapp_import_partners()``.
+"""
+import csv
+import itertools
+
+from .phone import normalize_phone_number
+
+IMPORT_FIELDS = ('name', 'phone', 'mobile', 'email')
+
+
+def iter_csv_batches(text_stream, batch_size):
+    """Yield lists of at most ``batch_size`` row dicts read lazily from a CSV text stream."""
+    reader = csv.DictReader(text_stream)
+    while True:
+        batch = list(itertools.islice(reader, batch_size))
+        if not batch:
+            return
+        yield [{key: (row.get(key) or '').strip() for key in IMPORT_FIELDS} for row in batch]
+
+
+def normalize_row(row):
+    """Return ``row`` with its ``normalized_phone`` / ``normalized_mobile`` keys precomputed."""
+    row = dict(row)
+    row['normalized_phone'] = normalize_phone_number(row['phone']) if row.get('phone') else False
+    row['normalized_mobile'] = normalize_phone_number(row['mobile']) if row.get('mobile') else False
+    return row
+
+
+def normalize_rows(rows, pool=None):
+    """Normalize a batch of rows, in ``pool`` (a concurrent.futures executor) when given."""
+    if pool is None:
+        return [normalize_row(row) for row in rows]
+    return list(pool.map(normalize_row, rows, chunksize=max(len(rows) // 32, 1)))
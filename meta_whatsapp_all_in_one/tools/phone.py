@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+import functools
+
+import phonenumbers
+
+NORMALIZE_CACHE_SIZE = 262144
+
+
+@functools.lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def normalize_phone_number(number):
+    """
+    Normalize a phone number to E.164 format. Pure function, memoized, and
+    safe to call from worker processes (no ORM access).
+    """
+    try:
+        number = ''.join(char for char in str(number) if char.isdigit() or char == '+')
+        if str(number).startswith('00'):
+            number = str(number)[2:]
+        if str(number).startswith('0'):
+            number = str(number).lstrip('0')
+        if str(number).startswith('+'):
+            number = str(number).lstrip('+')
+        normalized = ''.join(filter(str.isdigit, number))
+        parsed_number = phonenumbers.parse(normalized)
+        return phonenumbers.format_number(parsed_number, phonenumbers.PhoneNumberFormat.E164)
+    except phonenumbers.NumberParseException:
+        return number
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+Per-configuration Graph API rate limit awareness.
+
+After each call, the usage headers (``X-App-Usage`` and
+``X-Business-Use-Case-Usage``) and throttling error codes are fed to the
+tracker of the configuration. Before each call the tracker spaces calls out
+once usage gets high, and pauses them entirely when Meta reports that the
+number is throttled. It never blocks: a call that has to wait raises
+RateLimitPaused, for the caller to queue it until then. Trackers live in memory, one per configuration and
+worker process.
+"""
+import json
+import threading
+import time
+
+SLOWDOWN_THRESHOLD = 75
+PAUSE_THRESHOLD = 95
+MAX_SLOWDOWN = 2.0
+DEFAULT_PAUSE = 60
+THROTTLED_ERROR_CODES = (4, 80007, 130429)
+PAIR_RATE_ERROR_CODE = 131056
+
+
+class RateLimitPaused(Exception):
+    """Raised instead of calling the Graph API while a configuration is paused."""
+
+    def __init__(self, config_id, until):
+        self.config_id = config_id
+        self.until = until
+        super().__init__(f"WhatsApp configuration {config_id} is rate limited for {max(until - time.time(), 0):.0f}s")
+
+
+class RateLimitTracker:
+
+    def __init__(self, config_id):
+        self.config_id = config_id
+        self.lock = threading.Lock()
+        self.usage = 0
+        self.paused_until = 0.0
+        self.last_error = None
+        self.updated_at = 0.0
+        self.synced_state = None
+        self.reset_at = 0.0
+        # earliest time of the next call while slowed down
+        self.next_call = 0.0
+
+    @property
+    def state(self):
+        if self.paused_until > time.time():
+            return 'paused'
+        if self.usage >= SLOWDOWN_THRESHOLD:
+            return 'slowed'
+        return 'ok'
+
+    def pause(self, seconds, reason=None):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.time() + seconds)
+            if reason:
+                self.last_error = reason
+
+    def pause_until(self, timestamp):
+        """Resume a pause known from another worker (e.g. stored on the configuration)."""
+        with self.lock:
+            self.paused_until = max(self.paused_until, timestamp)
+
+    def reset(self, reset_at=None):
+        """Lift the pause and forget the usage, e.g. after a manual reset done in any worker."""
+        with self.lock:
+            self.paused_until = 0.0
+            self.usage = 0
+            self.last_error = None
+            self.synced_state = None
+            self.next_call = 0.0
+            self.reset_at = reset_at or time.time()
+
+    def delay(self):
+        """Seconds between two calls: 0 when usage is low, growing with usage."""
+        if self.usage < SLOWDOWN_THRESHOLD:
+            return 0.0
+        return MAX_SLOWDOWN * min((self.usage - SLOWDOWN_THRESHOLD) / (PAUSE_THRESHOLD - SLOWDOWN_THRESHOLD), 1.0)
+
+    def before_request(self):
+        """
+        Raise RateLimitPaused while paused, or when the call comes before its
+        slot under the adaptive slowdown. Otherwise reserve the next slot.
+        """
+        now = time.time()
+        paused_until = self.paused_until
+        if paused_until > now:
+            raise RateLimitPaused(self.config_id, paused_until)
+        delay = self.delay()
+        if not delay:
+            return
+        with self.lock:
+            if self.next_call > now:
+                raise RateLimitPaused(self.config_id, self.next_call)
+            self.next_call = now + delay
+
+    def update(self, response):
+        """Update the tracker from a Graph API response."""
+        usage = 0
+        regain_minutes = 0
+        app_usage = _parse_header(response.headers.get('X-App-Usage'))
+        if isinstance(app_usage, dict):
+            usage = max([usage] + [value for value in app_usage.values() if isinstance(value, (int, float))])
+        business_usage = _parse_header(response.headers.get('X-Business-Use-Case-Usage'))
+        if isinstance(business_usage, dict):
+            for entries in business_usage.values():
+                for entry in entries if isinstance(entries, list) else []:
+                    usage = max(usage, entry.get('call_count', 0), entry.get('total_cputime', 0),
+                                entry.get('total_time', 0))
+                    regain_minutes = max(regain_minutes, entry.get('estimated_time_to_regain_access', 0))
+        with self.lock:
+            self.usage = usage
+            self.updated_at = time.time()
+        code = error_code(response)
+        if code in THROTTLED_ERROR_CODES or usage >= PAUSE_THRESHOLD:
+            self.pause(regain_minutes * 60 or DEFAULT_PAUSE, f"Graph API throttling (code {code or usage})")
+        elif code == PAIR_RATE_ERROR_CODE:
+            with self.lock:
+                self.last_error = f"Pair rate limit hit (code {code})"
+        return code
+
+    def snapshot(self):
+        return {
+            'state': self.state,
+            'usage': self.usage,
+            'paused_until': self.paused_until if self.paused_until > time.time() else 0.0,
+            'last_error': self.last_error,
+        }
+
+
+def _parse_header(value):
+    if not value:
+        return None
+    try:
+        return json.loads(value)
+    except ValueError:
+        return None
+
+
+def error_code(response):
+    """Return the Graph API error code of a failed response, or None."""
+    if response.status_code < 400:
+        return None
+    try:
+        return (response.json().get('error') or {}).get('code')
+    except ValueError:
+        return None
+
+
+_trackers = {}
+_trackers_lock = threading.Lock()
+
+
+def get_tracker(config_id):
+    """Return the rate limit tracker of a configuration in this worker."""
+    tracker = _trackers.get(config_id)
+    if tracker is None:
+        with _trackers_lock:
+            tracker = _trackers.setdefault(config_id, RateLimitTracker(config_id))
+    return tracker
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import random
+
+LOG_SAMPLE_RATE_PARAM = 'meta_whatsapp_all_in_one.log_sample_rate'
+PAYLOAD_PREVIEW_SIZE = 200
+
+
+class LazyLog:
+    """
+    Defer the computation of a log argument until the record is formatted,
+    so expensive values (recordset reads, payload dumps) are only built for
+    log lines that are actually emitted.
+    """
+    __slots__ = ('func', 'args')
+
+    def __init__(self, func, *args):
+        self.func = func
+        self.args = args
+
+    def __str__(self):
+        return str(self.func(*self.args))
+
+    __repr__ = __str__
+
+
+def payload_digest(payload, preview_size=PAYLOAD_PREVIEW_SIZE):
+    """Return a short, bounded description of a raw payload: size, sha256 prefix and a truncated preview."""
+    if isinstance(payload, str):
+        payload = payload.encode('utf-8', 'replace')
+    payload = payload or b''
+    preview = payload[:preview_size].decode('utf-8', 'replace')
+    if len(payload) > preview_size:
+        preview += '...'
+    return f"size={len(payload)} sha256={hashlib.sha256(payload).hexdigest()[:16]} preview={preview!r}"
+
+
+def log_sampled(logger, level, env, msg, *args):
+    """
+    Log ``msg`` at ``level`` for a sample of the calls. The sampling rate is read
+    from the ``meta_whatsapp_all_in_one.log_sample_rate`` system parameter (0.0 to
+    1.0, default 1.0), and only when ``level`` is enabled, so a disabled level
+    costs neither a database read nor argument formatting.
+    """
+    if not logger.isEnabledFor(level):
+        return
+    try:
+        rate = float(env['ir.config_parameter'].sudo().get_param(LOG_SAMPLE_RATE_PARAM, '1.0'))
+    except ValueError:
+        rate = 1.0
+    if rate >= 1.0 or random.random() < rate:
+        logger.log(level, msg, *args)
@@ -20,7 +20,9 @@
     ],
     "data": [
         'security/ir.model.access.csv',
+        'data/ir_cron.xml',
         'views/chatbot_configuration.xml',
+        'views/chatbot_rule.xml',
     ],
     # 'assets': {
     #     'web.assets_backend': [
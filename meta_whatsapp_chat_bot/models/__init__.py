@@ -1 +1,4 @@
-from . import chatbot
\ No newline at end of file
+from . import chatbot
+from . import chatbot_rule
+from . import chatbot_session
+from . import whatsapp_config
\ No newline at end of file
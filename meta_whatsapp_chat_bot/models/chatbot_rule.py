@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+import logging
+
+from odoo import models, fields, api, tools, _
+from odoo.exceptions import ValidationError
+from ..tools import RuleMatcher, check_regex
+
+_logger = logging.getLogger(__name__)
+
+
+class WhatsAppChatbotRule(models.Model):
+    _name = 'whatsapp.chatbot.rule'
+    _description = 'WhatsApp Chatbot Rule'
+    _order = 'sequence, id'
+
+    name = fields.Char(string="Name", required=True)
+    sequence = fields.Integer(string="Priority", default=10, help="Rules with a lower priority number are matched first")
+    active = fields.Boolean(string="Active", default=True)
+    config_ids = fields.Many2many(
+        'whatsapp.config',
+        string="Configurations",
+        help="Configurations the rule applies to. Leave empty to apply it to all of them."
+    )
+    match_type = fields.Selection(
+        [
+            ('keyword', 'Keyword'),
+            ('regex', 'Regular Expression'),
+            ('button', 'Button Payload'),
+        ],
+        string="Match On",
+        default='keyword',
+        required=True,
+    )
+    pattern = fields.Text(
+        string="Patterns",
+        required=True,
+        help="One keyword, regular expression or button payload per line. "
+             "Keywords match whole words, regardless of case."
+    )
+    reply = fields.Text(string="Reply", required=True, help="Text sent back when the rule matches")
+    step = fields.Char(
+        string="Current Step",
+        help="Only match while the chatbot session is at this step. Leave empty to match at any step."
+    )
+    next_step = fields.Char(
+        string="Next Step",
+        help="Step the session moves to once the rule matched. Leave empty to end the session."
+    )
+    save_as = fields.Char(string="Save Answer As", help="Store the matched message text in this session variable")
+
+    @api.constrains('match_type', 'pattern')
+    def _check_pattern(self):
+        """Regular expressions must compile as part of the combined expression of the matcher."""
+        for rule in self.filtered(lambda r: r.match_type == 'regex'):
+            for pattern in rule._get_patterns():
+                error = check_regex(pattern)
+                if error:
+                    raise ValidationError(_("Invalid regular expression %(pattern)s: %(error)s",
+                                            pattern=pattern, error=error))
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super(WhatsAppChatbotRule, self).create(vals_list)
+        self.env.registry.clear_cache()
+        return records
+
+    def write(self, vals):
+        res = super(WhatsAppChatbotRule, self).write(vals)
+        self.env.registry.clear_cache()
+        return res
+
+    def unlink(self):
+        res = super(WhatsAppChatbotRule, self).unlink()
+        self.env.registry.clear_cache()
+        return res
+
+    def _get_patterns(self):
+        self.ensure_one()
+        return [line.strip() for line in (self.pattern or '').splitlines() if line.strip()]
+
+    @api.model
+    @tools.ormcache('config_id', 'step')
+    def _get_matcher(self, config_id, step=False):
+        """
+        Compile the active rules of a configuration at a session step into a
+        matcher, cached per worker until a rule is created, modified or deleted.
+        """
+        rules = self.sudo().search([
+            '|', ('config_ids', '=', False), ('config_ids', 'in', [config_id]),
+            ('step', 'in', [False, step] if step else [False]),
+        ])
+        return RuleMatcher([(rule.id, rule.match_type, rule._get_patterns()) for rule in rules])
+
+    @api.model
+    def _match(self, config_id, text=None, payload=None, step=False):
+        """Return the highest priority rule of the configuration matching the text or button payload."""
+        rule_id = self._get_matcher(config_id, step or False).match(text=text, payload=payload)
+        return self.sudo().browse(rule_id) if rule_id else self.browse()
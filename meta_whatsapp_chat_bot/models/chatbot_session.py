@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+import logging
+from datetime import timedelta
+
+from odoo import models, fields, api, _
+
+_logger = logging.getLogger(__name__)
+
+SESSION_TTL = timedelta(hours=1)
+
+
+class WhatsAppChatbotSession(models.Model):
+    """
+    State of a chatbot conversation per (configuration, WhatsApp id): the
+    current flow step and the variables collected so far. Sessions expire
+    after SESSION_TTL without activity and are deleted by a cron.
+    """
+    _name = 'whatsapp.chatbot.session'
+    _description = 'WhatsApp Chatbot Session'
+    _rec_name = 'wa_id'
+
+    config_id = fields.Many2one('whatsapp.config', string="Configuration", required=True, ondelete='cascade')
+    wa_id = fields.Char(string="WhatsApp ID", required=True)
+    step = fields.Char(string="Current Step")
+    variables = fields.Json(string="Variables")
+    expires_at = fields.Datetime(string="Expires At", required=True, index=True)
+
+    _sql_constraints = [
+        ('config_wa_id_uniq', 'UNIQUE(config_id, wa_id)', 'Only one chatbot session per WhatsApp id and configuration.'),
+    ]
+
+    @api.model
+    def _get_state(self, config_id, wa_id):
+        """
+        Return the (step, variables) of the live session of ``wa_id``, or
+        (False, {}) when there is none. One lookup on the unique
+        (config_id, wa_id) index, bypassing the ORM.
+        """
+        self.env.cr.execute("""
+            SELECT step, variables, expires_at
+              FROM whatsapp_chatbot_session
+             WHERE config_id = %s AND wa_id = %s
+        """, (config_id, wa_id))
+        row = self.env.cr.fetchone()
+        if not row:
+            return False, {}
+        step, variables, expires_at = row
+        if expires_at < fields.Datetime.now():
+            return False, {}
+        return step, variables or {}
+
+    @api.model
+    def _set_state(self, config_id, wa_id, step, variables=None, ttl=SESSION_TTL):
+        """Upsert the session of ``wa_id`` and push back its expiry."""
+        self.env.cr.execute("""
+            INSERT INTO whatsapp_chatbot_session
+                   (config_id, wa_id, step, variables, expires_at, create_uid, write_uid, create_date, write_date)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, (now() AT TIME ZONE 'UTC'), (now() AT TIME ZONE 'UTC'))
+            ON CONFLICT (config_id, wa_id) DO UPDATE
+               SET step = EXCLUDED.step,
+                   variables = EXCLUDED.variables,
+                   expires_at = EXCLUDED.expires_at,
+                   write_date = EXCLUDED.write_date
+        """, (config_id, wa_id, step, self._fields['variables'].convert_to_column(variables or {}, self),
+              fields.Datetime.now() + ttl, self.env.uid, self.env.uid))
+        self.invalidate_model(['step', 'variables', 'expires_at'])
+
+    @api.model
+    def _clear_state(self, config_id, wa_id):
+        """End the session of ``wa_id``."""
+        self.env.cr.execute(
+            "DELETE FROM whatsapp_chatbot_session WHERE config_id = %s AND wa_id = %s",
+            (config_id, wa_id),
+        )
+
+    @api.model
+    def _cron_cleanup_expired(self, batch_size=1000):
+        """Delete expired sessions in batches, committing between them."""
+        while True:
+            self.env.cr.execute("""
+                DELETE FROM whatsapp_chatbot_session
+                 WHERE id IN (
+                        SELECT id
+                          FROM whatsapp_chatbot_session
+                         WHERE expires_at < (now() AT TIME ZONE 'UTC')
+                         LIMIT %s
+                 )
+            """, (batch_size,))
+            deleted = self.env.cr.rowcount
+            _logger.debug("Deleted %s expired WhatsApp chatbot sessions", deleted)
+            self.env.cr.commit()
+            if deleted < batch_size:
+                return
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+from odoo import models
+from odoo.addons.meta_whatsapp_all_in_one.tools import measure
+
+
+def _extract_text_and_payload(message):
+    """Return the text and the button payload (if any) of an inbound webhook message."""
+    message_type = message.get('type')
+    if message_type == 'text':
+        return message.get('text', {}).get('body'), None
+    if message_type == 'button':
+        button = message.get('button', {})
+        return button.get('text'), button.get('payload')
+    if message_type == 'interactive':
+        interactive = message.get('interactive', {})
+        reply = interactive.get('button_reply') or interactive.get('list_reply') or {}
+        return reply.get('title'), reply.get('id')
+    return None, None
+
+
+class WhatsAppConfig(models.Model):
+    _inherit = 'whatsapp.config'
+
+    def _handle_inbound_messages(self, inbound):
+        super(WhatsAppConfig, self)._handle_inbound_messages(inbound)
+        Rule = self.env['whatsapp.chatbot.rule']
+        Session = self.env['whatsapp.chatbot.session'].sudo()
+        for item in inbound:
+            text, payload = _extract_text_and_payload(item['message'])
+            if not text and not payload:
+                continue
+            with measure('chatbot.decide'):
+                wa_id = item['message'].get('from')
+                step, variables = Session._get_state(self.id, wa_id)
+                rule = Rule._match(self.id, text=text, payload=payload, step=step)
+                if not rule:
+                    continue
+                if rule.next_step:
+                    if rule.save_as:
+                        variables = dict(variables, **{rule.save_as: text})
+                    Session._set_state(self.id, wa_id, rule.next_step, variables)
+                elif step:
+                    Session._clear_state(self.id, wa_id)
+                self._send_chatbot_reply(rule, item)
+
+    def _send_chatbot_reply(self, rule, item):
+        """
+        Queue the reply of a matched rule to the author of an inbound message.
+        The outbound dispatcher sends it after the webhook transaction is
+        committed, so the webhook never waits on the Graph API.
+        """
+        self.ensure_one()
+        self.env['whatsapp.outbound.message'].sudo()._enqueue(
+            self,
+            item['message'].get('from'),
+            {'type': 'text', 'text': {'body': rule.reply}},
+            partner=item['partner'],
+            body=rule.reply,
+            user=item['history'].user,
+        )
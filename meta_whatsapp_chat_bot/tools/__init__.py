@@ -0,0 +1 @@
+from .matcher import KeywordAutomaton, RuleMatcher, check_regex
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+import logging
+import re
+from collections import deque
+
+_logger = logging.getLogger(__name__)
+
+# Constructs that only make sense in a standalone pattern: references to
+# numbered or named groups, whose numbers and names change once the pattern
+# is combined with the others, and conditional groups
+GROUP_REFERENCE = re.compile(r'(?<!\\)(?:\\\\)*\\[1-9]|\(\?P=|\(\?\(')
+
+
+def wrap_regex(pattern, group):
+    """Wrap ``pattern`` as the ``group`` alternative of the combined expression, anchored at the start."""
+    return f"(?P<{group}>(?s:.*?)(?:{pattern}))"
+
+
+def check_regex(pattern):
+    """
+    Return why ``pattern`` cannot be part of the combined expression of the
+    matcher, or None when it can.
+    """
+    try:
+        compiled = re.compile(pattern)
+        re.compile(wrap_regex(pattern, 'r'), re.IGNORECASE)
+    except re.error as e:
+        # e.g. global inline flags, only allowed at the start of the whole expression
+        return str(e)
+    if compiled.groupindex:
+        return "named groups are not supported"
+    if GROUP_REFERENCE.search(pattern):
+        return "group references and conditional groups are not supported"
+    return None
+
+
+class KeywordAutomaton:
+    """
+    Aho-Corasick automaton over lowercased keywords. Finds every keyword of a
+    text in a single pass, whatever the number of keywords.
+    """
+
+    def __init__(self, keywords):
+        """``keywords`` is an iterable of (keyword, value) pairs."""
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        for keyword, value in keywords:
+            keyword = keyword.strip().lower()
+            if keyword:
+                self._add(keyword, value)
+        self._build()
+
+    def _add(self, keyword, value):
+        node = 0
+        for char in keyword:
+            next_node = self.goto[node].get(char)
+            if next_node is None:
+                next_node = len(self.goto)
+                self.goto[node][char] = next_node
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+            node = next_node
+        self.output[node].append((len(keyword), value))
+
+    def _build(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def __bool__(self):
+        return len(self.goto) > 1
+
+    def iter_matches(self, text):
+        """Yield the value of every keyword found as a whole word in ``text``."""
+        text = text.lower()
+        node = 0
+        for end, char in enumerate(text, 1):
+            while node and char not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(char, 0)
+            for length, value in self.output[node]:
+                start = end - length
+                if (start == 0 or not text[start - 1].isalnum()) and (end == len(text) or not text[end].isalnum()):
+                    yield value
+
+
+class RuleMatcher:
+    """
+    Immutable index of the active chatbot rules of one configuration: exact
+    lookup for button payloads, one Aho-Corasick automaton for all keywords
+    and one combined regular expression whose alternatives are ordered by
+    priority. ``rules`` are (rule_id, match_type, patterns) tuples, already
+    sorted by priority; the matched rule is the first one in that order.
+    """
+
+    def __init__(self, rules):
+        self.rank = {}
+        self.payloads = {}
+        keywords = []
+        regex_parts = []
+        self.regex_groups = {}
+        for rank, (rule_id, match_type, patterns) in enumerate(rules):
+            self.rank[rule_id] = rank
+            for pattern in patterns:
+                if match_type == 'button':
+                    self.payloads.setdefault(pattern, rule_id)
+                elif match_type == 'keyword':
+                    keywords.append((pattern, rule_id))
+                elif match_type == 'regex':
+                    error = check_regex(pattern)
+                    if error:
+                        _logger.warning("Skipping pattern %r of chatbot rule %s: %s", pattern, rule_id, error)
+                        continue
+                    # anchored at the start, so alternatives are tried in priority order
+                    group = f"r{rule_id}_{len(regex_parts)}"
+                    self.regex_groups[group] = rule_id
+                    regex_parts.append(wrap_regex(pattern, group))
+        self.keywords = KeywordAutomaton(keywords)
+        self.regex = re.compile(r'\A(?:%s)' % '|'.join(regex_parts), re.IGNORECASE) if regex_parts else None
+
+    def match(self, text=None, payload=None):
+        """Return the id of the highest priority rule matching ``payload`` or ``text``, or None."""
+        candidates = []
+        if payload and payload in self.payloads:
+            candidates.append(self.payloads[payload])
+        if text:
+            if self.keywords:
+                candidates.extend(self.keywords.iter_matches(text))
+            if self.regex:
+                found = self.regex.match(text)
+                if found:
+                    candidates.append(self.regex_groups[found.lastgroup])
+        if not candidates:
+            return None
+        return min(candidates, key=self.rank.__getitem__)